@@ -14,10 +14,22 @@ d_alt= 5 n_vknot= 3 n_oatf= 7 n_gvw= 3 n_clp= 11
 time= 30.0 vknot= 0.01 alt= 3000 pcnr= 100.0 gvw= 46000 clp= 70
 """
 # import cProfile
+import copy
+import os
 import sys
 from pyDAG import LookupTable
 from pyDAG import InFile
 from pyDAG import ode
+from pyDAG import sweep
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the ensemble derivatives (derivs_many).
+    numpy = None
+
+# Rotor load model next to this script, for sweeps
+CURVES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rotorCurves.txt')
 
 
 class SimpleThreeEngineRotor:
@@ -93,24 +105,8 @@ class SimpleThreeEngineRotor:
         self.oatf_t = []
         self.gvw_t = []
         self.clp_t = []
-        self.hptot_0_0 = LookupTable()
-        self.hptot_0_1 = LookupTable()
-        self.hptot_1_0 = LookupTable()
-        self.hptot_1_1 = LookupTable()
-        self.hptot_2_0 = LookupTable()
-        self.hptot_2_1 = LookupTable()
-        self.hpmr_0_0 = LookupTable()
-        self.hpmr_0_1 = LookupTable()
-        self.hpmr_1_0 = LookupTable()
-        self.hpmr_1_1 = LookupTable()
-        self.hpmr_2_0 = LookupTable()
-        self.hpmr_2_1 = LookupTable()
-        self.hptr_0_0 = LookupTable()
-        self.hptr_0_1 = LookupTable()
-        self.hptr_1_0 = LookupTable()
-        self.hptr_1_1 = LookupTable()
-        self.hptr_2_0 = LookupTable()
-        self.hptr_2_1 = LookupTable()
+        # hptot, hpmr and hptr outputs on the (alt, vknot, oatf, gvw, clp) axes
+        self.hp = LookupTable()
 
     def assign_inputs(self, qmrload, qtrload, qgas1, qgas2, qgas3):
         """Assign the external inputs of the system, e.g. the u's of Ax+Bu"""
@@ -123,10 +119,20 @@ class SimpleThreeEngineRotor:
 
     def derivs(self, (n_mr, n_tr, nt, n1, n2, n3, qmr, qtr, q1, q2, q3)):
         """Generalized derivative calculator for the class"""
-        d_nmr = (-self.qmrload + qmr - (n_mr - nt) * self.dlagm - self.damcoef * self.qmrload / max(n_mr, 1) * (
+        return self._rates(n_mr, n_tr, nt, n1, n2, n3, qmr, qtr, q1, q2, q3, max)
+
+    def derivs_many(self, states):
+        """Vectorized derivs for an ensemble of rotors, e.g. for ode.Rk4 with shape (M, 11).
+        states is an (M, 11) array; the parameters and inputs (j1, K1, qgas1, ...) may be scalars
+        or (M,) arrays of the values of each member."""
+        return numpy.array(self._rates(*(tuple(states.T) + (numpy.maximum,)))).T
+
+    def _rates(self, n_mr, n_tr, nt, n1, n2, n3, qmr, qtr, q1, q2, q3, maximum):
+        """Derivatives of the states, with maximum the element max of the state type"""
+        d_nmr = (-self.qmrload + qmr - (n_mr - nt) * self.dlagm - self.damcoef * self.qmrload / maximum(n_mr, 1) * (
                     n_mr - self.nomnp)) / self.jmr
         self.d_nmr = d_nmr
-        d_ntr = (-self.qtrload + qtr - (n_tr - nt) * self.Dht - self.datcoef * self.qtrload / max(n_tr, 1) * (
+        d_ntr = (-self.qtrload + qtr - (n_tr - nt) * self.Dht - self.datcoef * self.qtrload / maximum(n_tr, 1) * (
                     n_tr - self.nomnp)) / self.jtr
         d_nt = (q1 + q2 + q3 - qmr - qtr
                 - (nt - n1) * self.dp1 - (nt - n2) * self.dp2 - (nt - n3) * self.dp3 - (nt - n_mr) * self.dlagm - (
@@ -215,9 +221,9 @@ class SimpleThreeEngineRotor:
         curve_file.write(coutm)
         curve_file.write(coutt)
 
-    def load_curves(self):
+    def load_curves(self, path='rotorCurves.txt'):
         """Laboriously import the rotor load model"""
-        curves = InFile('rotorCurves.txt')
+        curves = InFile(path)
         curves.load()
         curves.tokenize(' \n\r')
         if not (curves.token(0, 1) == 'ALT' and
@@ -332,78 +338,12 @@ class SimpleThreeEngineRotor:
             hptot_t += [hptotj]
             hpmr_t += [hpmrj]
             hptr_t += [hptrj]
-        self.hptot_0_0.addAxis('x', self.oatf_t)
-        self.hptot_0_0.addAxis('y', self.gvw_t)
-        self.hptot_0_0.addAxis('z', self.clp_t)
-        self.hptot_0_0.setValueTable(hptot_t[0][0])
-        self.hptot_0_1.addAxis('x', self.oatf_t)
-        self.hptot_0_1.addAxis('y', self.gvw_t)
-        self.hptot_0_1.addAxis('z', self.clp_t)
-        self.hptot_0_1.setValueTable(hptot_t[0][1])
-        self.hptot_1_0.addAxis('x', self.oatf_t)
-        self.hptot_1_0.addAxis('y', self.gvw_t)
-        self.hptot_1_0.addAxis('z', self.clp_t)
-        self.hptot_1_0.setValueTable(hptot_t[1][0])
-        self.hptot_1_1.addAxis('x', self.oatf_t)
-        self.hptot_1_1.addAxis('y', self.gvw_t)
-        self.hptot_1_1.addAxis('z', self.clp_t)
-        self.hptot_1_1.setValueTable(hptot_t[1][1])
-        self.hptot_2_0.addAxis('x', self.oatf_t)
-        self.hptot_2_0.addAxis('y', self.gvw_t)
-        self.hptot_2_0.addAxis('z', self.clp_t)
-        self.hptot_2_0.setValueTable(hptot_t[2][0])
-        self.hptot_2_1.addAxis('x', self.oatf_t)
-        self.hptot_2_1.addAxis('y', self.gvw_t)
-        self.hptot_2_1.addAxis('z', self.clp_t)
-        self.hptot_2_1.setValueTable(hptot_t[2][1])
-        self.hpmr_0_0.addAxis('x', self.oatf_t)
-        self.hpmr_0_0.addAxis('y', self.gvw_t)
-        self.hpmr_0_0.addAxis('z', self.clp_t)
-        self.hpmr_0_0.setValueTable(hpmr_t[0][0])
-        self.hpmr_0_1.addAxis('x', self.oatf_t)
-        self.hpmr_0_1.addAxis('y', self.gvw_t)
-        self.hpmr_0_1.addAxis('z', self.clp_t)
-        self.hpmr_0_1.setValueTable(hpmr_t[0][1])
-        self.hpmr_1_0.addAxis('x', self.oatf_t)
-        self.hpmr_1_0.addAxis('y', self.gvw_t)
-        self.hpmr_1_0.addAxis('z', self.clp_t)
-        self.hpmr_1_0.setValueTable(hpmr_t[1][0])
-        self.hpmr_1_1.addAxis('x', self.oatf_t)
-        self.hpmr_1_1.addAxis('y', self.gvw_t)
-        self.hpmr_1_1.addAxis('z', self.clp_t)
-        self.hpmr_1_1.setValueTable(hpmr_t[1][1])
-        self.hpmr_2_0.addAxis('x', self.oatf_t)
-        self.hpmr_2_0.addAxis('y', self.gvw_t)
-        self.hpmr_2_0.addAxis('z', self.clp_t)
-        self.hpmr_2_0.setValueTable(hpmr_t[2][0])
-        self.hpmr_2_1.addAxis('x', self.oatf_t)
-        self.hpmr_2_1.addAxis('y', self.gvw_t)
-        self.hpmr_2_1.addAxis('z', self.clp_t)
-        self.hpmr_2_1.setValueTable(hpmr_t[2][1])
-        self.hptr_0_0.addAxis('x', self.oatf_t)
-        self.hptr_0_0.addAxis('y', self.gvw_t)
-        self.hptr_0_0.addAxis('z', self.clp_t)
-        self.hptr_0_0.setValueTable(hptr_t[0][0])
-        self.hptr_0_1.addAxis('x', self.oatf_t)
-        self.hptr_0_1.addAxis('y', self.gvw_t)
-        self.hptr_0_1.addAxis('z', self.clp_t)
-        self.hptr_0_1.setValueTable(hptr_t[0][1])
-        self.hptr_1_0.addAxis('x', self.oatf_t)
-        self.hptr_1_0.addAxis('y', self.gvw_t)
-        self.hptr_1_0.addAxis('z', self.clp_t)
-        self.hptr_1_0.setValueTable(hptr_t[1][0])
-        self.hptr_1_1.addAxis('x', self.oatf_t)
-        self.hptr_1_1.addAxis('y', self.gvw_t)
-        self.hptr_1_1.addAxis('z', self.clp_t)
-        self.hptr_1_1.setValueTable(hptr_t[1][1])
-        self.hptr_2_0.addAxis('x', self.oatf_t)
-        self.hptr_2_0.addAxis('y', self.gvw_t)
-        self.hptr_2_0.addAxis('z', self.clp_t)
-        self.hptr_2_0.setValueTable(hptr_t[2][0])
-        self.hptr_2_1.addAxis('x', self.oatf_t)
-        self.hptr_2_1.addAxis('y', self.gvw_t)
-        self.hptr_2_1.addAxis('z', self.clp_t)
-        self.hptr_2_1.setValueTable(hptr_t[2][1])
+        for name, axis_values in (('alt', self.alt_t), ('vknot', self.vknot_t), ('oatf', self.oatf_t),
+                                  ('gvw', self.gvw_t), ('clp', self.clp_t)):
+            self.hp.addAxis(name, axis_values)
+        self.hp.addOutput('hptot', hptot_t)
+        self.hp.addOutput('hpmr', hpmr_t)
+        self.hp.addOutput('hptr', hptr_t)
         self.hptot = hptot
         self.hpmr = hpmr
         self.hptr = hptr
@@ -415,56 +355,8 @@ class SimpleThreeEngineRotor:
         self.oatf = oatf
         self.gvw = gvw
         self.dynang = dynang
-        hptot_0kts_0ft = self.hptot_0_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptot_0kts_3kft = self.hptot_0_1.lookup(x=oatf, y=gvw, z=dynang)
-        hptot_80kts_0ft = self.hptot_1_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptot_80kts_3kft = self.hptot_1_1.lookup(x=oatf, y=gvw, z=dynang)
-        hptot_160kts_0ft = self.hptot_2_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptot_160kts_3kft = self.hptot_2_1.lookup(x=oatf, y=gvw, z=dynang)
-
-        hpmr_0kts_0ft = self.hpmr_0_0.lookup(x=oatf, y=gvw, z=dynang)
-        hpmr_0kts_3kft = self.hpmr_0_1.lookup(x=oatf, y=gvw, z=dynang)
-        hpmr_80kts_0ft = self.hpmr_1_0.lookup(x=oatf, y=gvw, z=dynang)
-        hpmr_80kts_3kft = self.hpmr_1_1.lookup(x=oatf, y=gvw, z=dynang)
-        hpmr_160kts_0ft = self.hpmr_2_0.lookup(x=oatf, y=gvw, z=dynang)
-        hpmr_160kts_3kft = self.hpmr_2_1.lookup(x=oatf, y=gvw, z=dynang)
-
-        hptr_0kts_0ft = self.hptr_0_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptr_0kts_3kft = self.hptr_0_1.lookup(x=oatf, y=gvw, z=dynang)
-        hptr_80kts_0ft = self.hptr_1_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptr_80kts_3kft = self.hptr_1_1.lookup(x=oatf, y=gvw, z=dynang)
-        hptr_160kts_0ft = self.hptr_2_0.lookup(x=oatf, y=gvw, z=dynang)
-        hptr_160kts_3kft = self.hptr_2_1.lookup(x=oatf, y=gvw, z=dynang)
-
-        if vknot < self.vknot_t[1]:
-            hptotv0 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hptot_80kts_0ft - hptot_0kts_0ft) + hptot_0kts_0ft
-            hptotv1 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hptot_80kts_3kft - hptot_0kts_3kft) + hptot_0kts_3kft
-            hpmrv0 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hpmr_80kts_0ft - hpmr_0kts_0ft) + hpmr_0kts_0ft
-            hpmrv1 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hpmr_80kts_3kft - hpmr_0kts_3kft) + hpmr_0kts_3kft
-            hptrv0 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hptr_80kts_0ft - hptr_0kts_0ft) + hptr_0kts_0ft
-            hptrv1 = (vknot - self.vknot_t[0]) / (self.vknot_t[1] - self.vknot_t[0]) * (
-                        hptr_80kts_3kft - hptr_0kts_3kft) + hptr_0kts_3kft
-        else:
-            hptotv0 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hptot_160kts_0ft - hptot_80kts_0ft) + hptot_80kts_0ft
-            hptotv1 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hptot_160kts_3kft - hptot_80kts_3kft) + hptot_80kts_3kft
-            hpmrv0 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hpmr_160kts_0ft - hpmr_80kts_0ft) + hpmr_80kts_0ft
-            hpmrv1 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hpmr_160kts_3kft - hpmr_80kts_3kft) + hpmr_80kts_3kft
-            hptrv0 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hptr_160kts_0ft - hptr_80kts_0ft) + hptr_80kts_0ft
-            hptrv1 = (vknot - self.vknot_t[1]) / (self.vknot_t[2] - self.vknot_t[1]) * (
-                        hptr_160kts_3kft - hptr_80kts_3kft) + hptr_80kts_3kft
-        self.hptot = (alt - self.alt_t[0]) / (self.alt_t[1] - self.alt_t[0]) * (hptotv1 - hptotv0) + hptotv0
-        self.hpmr = (alt - self.alt_t[0]) / (self.alt_t[1] - self.alt_t[0]) * (hpmrv1 - hpmrv0) + hpmrv0
-        self.hptr = (alt - self.alt_t[0]) / (self.alt_t[1] - self.alt_t[0]) * (hptrv1 - hptrv0) + hptrv0
+        (self.hptot, self.hpmr, self.hptr) = \
+            self.hp.lookup(alt=alt, vknot=vknot, oatf=oatf, gvw=gvw, clp=dynang)
         self.qtotload = self.hptot / self.n_mr * 5252.1131
         self.qmrload = self.hpmr / self.n_mr * 5252.1131
         self.qtrload = self.hptr / self.n_tr * 5252.1131
@@ -506,32 +398,14 @@ class SimpleThreeEngineRotor:
         return cout
 
 
-def main():
-    # noinspection PyUnresolvedReferences
-    import rotorModel
-    # Initial inputs
-    # d_qload = 0
-    zdynang = 70
-    alt = 3000
-    vknot = 0.01
-    oatf = 59
-    gvw = 46000
-    final_time = 30
-    d_time = 0.006
-
-    # Setup the rotor model
-    r_m = rotorModel.SimpleThreeEngineRotor(d_time)
-
-    if r_m.load_curves() == -1:
-        print 'failed to load rotorCurves'
-        return -1
-
-    r_m.write_curves()
+def simulate(r_m, results_file, alt=3000, vknot=0.01, oatf=59, gvw=46000, zdynang=70, final_time=30):
+    """Run the transient of a rotor with loaded curves, at steps of r_m.d_time,
+    writing the results to results_file.  Return (time, pcnr) at the end."""
+    d_time = r_m.d_time
 
     # Executive initialization
     nomnp = r_m.nomnp
     i = 0
-    results_file = file('rotorModel.csv', 'wb')
 
     # Rotor initialization
     (qtotload, qmrload, qtrload) = r_m.load_lookup(alt, vknot, oatf, gvw, zdynang)
@@ -572,9 +446,65 @@ def main():
             break
         i += 1
 
+    return time, pcnr
+
+
+def main():
+    # noinspection PyUnresolvedReferences
+    import rotorModel
+    # Initial inputs
+    # d_qload = 0
+    zdynang = 70
+    alt = 3000
+    vknot = 0.01
+    oatf = 59
+    gvw = 46000
+    final_time = 30
+    d_time = 0.006
+
+    # Setup the rotor model
+    r_m = rotorModel.SimpleThreeEngineRotor(d_time)
+
+    if r_m.load_curves() == -1:
+        print 'failed to load rotorCurves'
+        return -1
+
+    r_m.write_curves()
+
+    results_file = file('rotorModel.csv', 'wb')
+    (time, pcnr) = rotorModel.simulate(r_m, results_file, alt, vknot, oatf, gvw, zdynang, final_time)
+    results_file.close()
+
     print 'time=', time, 'vknot=', vknot, 'alt=', alt, 'pcnr=', pcnr, 'gvw=', gvw, 'clp=', zdynang
 
 
+def load_rotor(path=CURVES, d_time=0.006):
+    """Sweep setup: return a rotor with the curves at path loaded and its load table frozen,
+    to be shared by the cases"""
+    r_m = SimpleThreeEngineRotor(d_time)
+    if r_m.load_curves(path) == -1:
+        raise IOError('failed to load ' + path)
+    r_m.hp.freeze()
+    return r_m
+
+
+def sweep_case(case, rotor, results_file):
+    """Sweep case: run simulate with the arguments in the case dict (and its d_time, if any)
+    on a copy of the loaded rotor, sharing its load table"""
+    r_m = copy.copy(rotor)
+    case = case.copy()
+    r_m.d_time = case.pop('d_time', rotor.d_time)
+    return simulate(r_m, results_file, **case)
+
+
+def sweep_main(axes, workers=None, output_dir='rotorSweep'):
+    """Run the transients for every combination of the [(name, values), ...] axes, e.g.
+    [('alt', [0, 3000]), ('zdynang', [50, 70])], in parallel (see sweep.run_sweep)"""
+    # noinspection PyUnresolvedReferences
+    import rotorModel
+    return sweep.run_sweep(rotorModel.sweep_case, sweep.grid(axes), rotorModel.load_rotor, workers, output_dir)
+
+
 if __name__ == '__main__':
     sys.exit(main())
     # sys.exit(cProfile.run("main()"))
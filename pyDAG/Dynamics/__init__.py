@@ -1 +1,2 @@
 import ode
+import sweep
@@ -2,7 +2,56 @@
 """ode.py    Ordinary differential equation tools
 02-Dec-2007  DA Gutz  Created
 
+euler and rk4 work on lists.  euler_array and Rk4 do the same on float64
+numpy arrays, reusing preallocated stage buffers.  DormandPrince adapts the
+step size to relative and absolute error tolerances, with dense output.
+Rosenbrock does the same with a linearly implicit method, for stiff systems.
+
+The doctests can be run by running this script directly with Python:
+python ode.py
+
 """
+import math
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the array integrators.
+    numpy = None
+
+
+class Error(Exception):
+    """ODE Error"""
+    pass
+
+
+# Dormand-Prince 5(4) tableau: stage times, stage coefficients (the last row
+# is the 5th order solution), error estimate (5th - 4th order) weights, and
+# dense output polynomial coefficients (as in Hairer's DOPRI5)
+DP_C = (0., 1. / 5, 3. / 10, 4. / 5, 8. / 9, 1., 1.)
+DP_A = ((),
+        (1. / 5,),
+        (3. / 40, 9. / 40),
+        (44. / 45, -56. / 15, 32. / 9),
+        (19372. / 6561, -25360. / 2187, 64448. / 6561, -212. / 729),
+        (9017. / 3168, -355. / 33, 46732. / 5247, 49. / 176,
+         -5103. / 18656),
+        (35. / 384, 0., 500. / 1113, 125. / 192, -2187. / 6784, 11. / 84))
+DP_E = (-71. / 57600, 0., 71. / 16695, -71. / 1920, 17253. / 339200,
+        -22. / 525, 1. / 40)
+DP_P = ((1., -8048581381. / 2820520608, 8663915743. / 2820520608,
+         -12715105075. / 11282082432),
+        (0., 0., 0., 0.),
+        (0., 131558114200. / 32700410799, -68118460800. / 10900136933,
+         87487479700. / 32700410799),
+        (0., -1754552775. / 470086768, 14199869525. / 1410260304,
+         -10690763975. / 1880347072),
+        (0., 127303824393. / 49829197408, -318862633887. / 49829197408,
+         701980252875. / 199316789632),
+        (0., -282668133. / 205662961, 2019193451. / 616988883,
+         -1453857185. / 822651844),
+        (0., 40617522. / 29380423, -110615467. / 29380423,
+         69997945. / 29380423))
 
 
 def euler(state, rate, i_range, dt, limits=None):
@@ -39,3 +88,495 @@ def rk4(obj, dt):
     k4 = obj.derivs(euler(obj.yp, k3, i_range, dt))
     rk4_rate = [(k1[i] + 2 * k2[i] + 2 * k3[i] + k4[i]) / 6 for i in i_range]
     obj.y = euler(obj.yp, rk4_rate, i_range, dt, obj.ylims)
+
+
+def limit_arrays(limits):
+    """Return (lower, upper) float64 arrays of a list of limit tuples,
+    e.g. obj.ylims, for euler_array.  For an ensemble, limits may also be
+    an (M, n, 2) array of limits for each member."""
+    limits = numpy.asarray(limits, dtype=numpy.float64)
+    return numpy.ascontiguousarray(limits[..., 0]), \
+        numpy.ascontiguousarray(limits[..., 1])
+
+
+def euler_array(state, rate, dt, limits=None, out=None):
+    """Array version of euler: state + rate * dt, with one vectorized clip
+    Item                            Description
+    state, rate                     float64 arrays
+    limits                          (lower, upper) arrays, see limit_arrays
+    out                             array for the result (default new one);
+                                    may not be state
+    return value                    out
+
+    """
+    out = numpy.multiply(rate, dt, out)
+    out += state
+    if limits is not None:
+        numpy.clip(out, limits[0], limits[1], out)
+    return out
+
+
+class Rk4:
+    """Explicit RK4 integration on float64 arrays.
+    The stage derivatives and states go in buffers allocated once, so a
+    step allocates nothing beyond what derivs returns.  The arithmetic is
+    that of rk4, so the results match.
+    Item                            Description
+    derivs(state)                   Function returning the derivatives (an
+                                    array or sequence) of a state array
+    n                               Number of states, or the shape (M, n)
+                                    of an ensemble of M systems advanced
+                                    together, with derivs vectorized over
+                                    (M, n) state arrays
+    ylims                           List of state limit tuples, as obj.ylims
+                                    of rk4, shared by the members of an
+                                    ensemble, or per member (see
+                                    limit_arrays), or None
+    list_derivs                     Pass derivs lists rather than arrays;
+                                    faster for small systems with scalar
+                                    derivs code, as arithmetic on numpy
+                                    scalars is slow
+
+    >>> def derivs(y):
+    ...     return -y
+    >>> integrator = Rk4(derivs, 2, [(0.5, 2.), (-2., 2.)])
+    >>> y = integrator.step(numpy.array([1., 1.]), 0.5)
+    >>> print y
+    [0.60677083 0.60677083]
+    >>> y = integrator.step(y, 0.5, y)
+    Traceback (most recent call last):
+    Error: out may not be the past state
+    >>> print integrator.step(y, 0.5)
+    [0.5        0.36817084]
+
+    An ensemble of 3 systems, with a different rate for each:
+
+    >>> rates = numpy.array([[1.], [2.], [4.]])
+    >>> def ensemble_derivs(y):
+    ...     return -rates * y
+    >>> integrator = Rk4(ensemble_derivs, (3, 1), [(0.1, 2.)])
+    >>> print integrator.step(numpy.ones((3, 1)), 0.5).ravel()
+    [0.60677083 0.375      0.33333333]
+    >>> print Rk4(derivs, long(2)).step(numpy.array([1., 1.]), 0.5)
+    [0.60677083 0.60677083]
+
+    """
+
+    def __init__(self, derivs, n, ylims=None, list_derivs=False):
+        if numpy is None:
+            raise Error('Rk4 requires numpy')
+        self.derivs = derivs
+        if list_derivs:
+            self.derivs = lambda state: derivs(state.tolist())
+        self.limits = None
+        if ylims is not None:
+            self.limits = limit_arrays(ylims)
+        if numpy.ndim(n) == 0:
+            n = (n,)
+        self._k = numpy.empty((4,) + tuple(n))
+        self._stage = numpy.empty(n)
+        self._rate = numpy.empty(n)
+
+    def step(self, yp, dt, out=None):
+        """Return the state dt after the past state array yp, clipped to
+        the limits, in out if given (a new array otherwise)"""
+        if out is yp:
+            raise Error('out may not be the past state')
+        k = self._k
+        stage = self._stage
+        rate = self._rate
+        k[0] = self.derivs(yp)
+        k[1] = self.derivs(euler_array(yp, k[0], dt / 2, out=stage))
+        k[2] = self.derivs(euler_array(yp, k[1], dt / 2, out=stage))
+        k[3] = self.derivs(euler_array(yp, k[2], dt, out=stage))
+        # (k1 + 2 * k2 + 2 * k3 + k4) / 6, in the same order as rk4
+        numpy.multiply(k[1], 2, rate)
+        rate += k[0]
+        rate += numpy.multiply(k[2], 2, stage)
+        rate += k[3]
+        rate /= 6
+        return euler_array(yp, rate, dt, self.limits, out)
+
+    def integrate(self, obj, dt):
+        """rk4 on an object with array states: obj.y from obj.yp, in place
+        when obj.y is already a separate array"""
+        out = obj.y
+        if not isinstance(out, numpy.ndarray) or out is obj.yp:
+            out = None
+        obj.y = self.step(obj.yp, dt, out)
+
+
+class Adaptive:
+    """Adaptive step size integration on float64 arrays, the common part
+    of DormandPrince and Rosenbrock.
+    Each step is accepted when the error estimate, scaled by
+    atol + rtol * |y| per state, has an rms of at most 1; the step size
+    then follows the error, so quasi-steady stretches take long steps.
+    Item                            Description
+    derivs(state)                   As for Rk4
+    n                               Number of states (an int; ensembles of
+                                    systems are not supported)
+    ylims, list_derivs              As for Rk4; accepted states and dense
+                                    output are clipped to the limits
+    rtol, atol                      Relative and absolute error tolerances
+    dt                              First step size (default estimated)
+    dt_max                          Largest step size
+    n_evals, n_steps, n_rejected    Counts of derivs calls and of accepted
+                                    and rejected steps
+    Use reset(t, y) and then advance(t_out) for each output time, or
+    integrate(obj, dt) as rk4(obj, dt).  Subclasses define step(t_stop)
+    and dense(t).
+
+    """
+
+    def __init__(self, derivs, n, ylims=None, rtol=1e-6, atol=1e-9,
+                 dt=None, dt_max=None, list_derivs=False):
+        if numpy is None:
+            raise Error('%s requires numpy' % self.__class__.__name__)
+        if numpy.ndim(n) != 0:
+            raise Error('%s takes a number of states, not a shape'
+                        % self.__class__.__name__)
+        self.derivs = derivs
+        if list_derivs:
+            self.derivs = lambda state: derivs(state.tolist())
+        self.limits = None
+        if ylims is not None:
+            self.limits = limit_arrays(ylims)
+        self.rtol = rtol
+        self.atol = atol
+        self.dt = dt
+        self.dt_max = dt_max or numpy.inf
+        self.n_evals = 0
+        self.n_steps = 0
+        self.n_rejected = 0
+        self.t = None
+        self.y = None
+        self._f_fresh = False
+        self._t_old = None
+
+    def reset(self, t, y):
+        """Start from state y at time t (the step size is kept)"""
+        self.t = float(t)
+        self.y = numpy.array(y, dtype=numpy.float64)
+        self._f_fresh = False
+        self._t_old = None
+
+    def _derivs(self, state):
+        self.n_evals += 1
+        return self.derivs(state)
+
+    def _error_norm(self, error, y, y_new):
+        """Return the rms of error scaled by the tolerances"""
+        scale = numpy.maximum(numpy.abs(y), numpy.abs(y_new))
+        scale *= self.rtol
+        scale += self.atol
+        error = error / scale
+        return numpy.sqrt(numpy.mean(error * error))
+
+    def _initial_dt(self, f0, order):
+        """Hairer's estimate of the first step size, from the derivatives
+        f0 at the initial state and the order of the method"""
+        scale = self.atol + numpy.abs(self.y) * self.rtol
+        d0 = numpy.sqrt(numpy.mean((self.y / scale) ** 2))
+        d1 = numpy.sqrt(numpy.mean((f0 / scale) ** 2))
+        if d0 < 1e-5 or d1 < 1e-5:
+            dt = 1e-6
+        else:
+            dt = 0.01 * d0 / d1
+        dt = min(dt, self.dt_max)
+        d2 = numpy.sqrt(numpy.mean(
+            ((self._derivs(self.y + f0 * dt) - f0) / scale) ** 2)) / dt
+        if max(d1, d2) <= 1e-15:
+            dt1 = max(1e-6, dt * 1e-3)
+        else:
+            dt1 = (0.01 / max(d1, d2)) ** (1. / (order + 1))
+        return min(100 * dt, dt1, self.dt_max)
+
+    def _accept(self, y_new, dt, truncated, factor):
+        """Clip the accepted state y_new, make it the state and advance the
+        time; return True if it was clipped"""
+        self.n_steps += 1
+        if not truncated:
+            self.dt = dt * factor
+        else:
+            self.dt = max(self.dt, dt * factor)
+        clipped = False
+        if self.limits is not None:
+            clipped_y = numpy.clip(y_new, self.limits[0], self.limits[1])
+            clipped = not (clipped_y == y_new).all()
+            y_new[:] = clipped_y
+        self._t_old = self.t
+        self._dt_old = dt
+        if truncated:
+            self.t = self._t_stop
+        else:
+            self.t += dt
+        return clipped
+
+    def _step_size(self, t_stop):
+        """Return (dt, truncated) for the next try, ending at t_stop at
+        the latest"""
+        dt = min(self.dt, self.dt_max)
+        self._t_stop = t_stop
+        if t_stop is not None and self.t + dt >= t_stop:
+            return t_stop - self.t, True
+        return dt, False
+
+    def _reject(self, dt, factor):
+        """Shrink the step size after a rejected try"""
+        self.n_rejected += 1
+        self.dt = dt * factor
+        if self.t + self.dt == self.t:
+            raise Error('step size too small at t=%g' % self.t)
+
+    def _check_dense(self, t):
+        if self._t_old is None or not self._t_old <= t <= self.t:
+            raise Error('t=%g is not within the last step' % t)
+
+    def advance(self, t_out):
+        """Integrate past t_out as needed and return the state at t_out"""
+        while self.t < t_out:
+            self.step()
+        if t_out == self.t:
+            return self.y.copy()
+        return self.dense(t_out)
+
+    def integrate(self, obj, dt):
+        """Adaptive rk4(obj, dt): obj.y is obj.yp integrated over dt,
+        stepping exactly to dt.  The derivatives are evaluated afresh at
+        obj.yp each call, as the inputs of obj may have changed, and the
+        step size carries over between calls."""
+        self.reset(0., obj.yp)
+        while self.t < dt:
+            self.step(dt)
+        obj.y = self.y.copy()
+
+
+class DormandPrince(Adaptive):
+    """Adaptive explicit Runge-Kutta 5(4) (Dormand-Prince) integration on
+    float64 arrays, see Adaptive.
+    The last derivative of a step is reused as the first of the next
+    (6 derivs calls per step), and dense output interpolates within a step
+    to 4th order without extra calls.
+
+    >>> def derivs(y):
+    ...     return -y
+    >>> integrator = DormandPrince(derivs, 1, rtol=1e-8, atol=1e-10)
+    >>> integrator.reset(0., [1.])
+    >>> for t_out in (0.5, 1., 10.):
+    ...     y = integrator.advance(t_out)
+    ...     print t_out, abs(y[0] / numpy.exp(-t_out) - 1.) < 1e-7
+    0.5 True
+    1.0 True
+    10.0 True
+    >>> print integrator.n_steps, integrator.n_evals, integrator.n_rejected
+    85 512 0
+    >>> DormandPrince(derivs, (3, 1))
+    Traceback (most recent call last):
+    Error: DormandPrince takes a number of states, not a shape
+
+    """
+
+    def __init__(self, derivs, n, ylims=None, rtol=1e-6, atol=1e-9,
+                 dt=None, dt_max=None, list_derivs=False):
+        Adaptive.__init__(self, derivs, n, ylims, rtol, atol, dt, dt_max,
+                          list_derivs)
+        self._e = numpy.array(DP_E)
+        self._p = numpy.array(DP_P)
+        self._k = numpy.empty((7, n))
+        self._stage = numpy.empty(n)
+        self._y_new = numpy.empty(n)
+        self._y_old = numpy.empty(n)
+        self._q = numpy.empty((n, 4))
+
+    def step(self, t_stop=None):
+        """Take one accepted step, ending at t_stop at the latest, and
+        return the new time"""
+        k = self._k
+        y = self.y
+        stage = self._stage
+        y_new = self._y_new
+        if not self._f_fresh:
+            k[0] = self._derivs(y)
+            self._f_fresh = True
+        if self.dt is None:
+            self.dt = self._initial_dt(k[0], 4)
+        while True:
+            dt, truncated = self._step_size(t_stop)
+            for i in range(1, 7):
+                out = stage
+                if i == 6:
+                    out = y_new
+                numpy.dot(DP_A[i], k[:i], out)
+                out *= dt
+                out += y
+                k[i] = self._derivs(out)
+            error_norm = self._error_norm(numpy.dot(self._e, k) * dt, y,
+                                          y_new)
+            if error_norm <= 1.:
+                break
+            self._reject(dt, max(0.2, 0.9 * error_norm ** -0.2))
+
+        if error_norm == 0.:
+            factor = 10.
+        else:
+            factor = min(10., 0.9 * error_norm ** -0.2)
+        self._y_old[:] = y
+        numpy.dot(k.T, self._p, self._q)
+        if self._accept(y_new, dt, truncated, factor):
+            self._f_fresh = False
+        else:
+            k[0] = k[6]
+        self.y, self._y_new = y_new, y
+        return self.t
+
+    def dense(self, t):
+        """Return the state at time t within the last step"""
+        self._check_dense(t)
+        if t == self.t:
+            return self.y.copy()
+        x = (t - self._t_old) / self._dt_old
+        y = numpy.dot(self._q, [x, x * x, x ** 3, x ** 4])
+        y *= self._dt_old
+        y += self._y_old
+        if self.limits is not None:
+            numpy.clip(y, self.limits[0], self.limits[1], y)
+        return y
+
+
+class Rosenbrock(Adaptive):
+    """Adaptive linearly implicit (Rosenbrock) integration for stiff
+    systems, on float64 arrays, see Adaptive.
+    This is the L-stable 2(3) method of Shampine and Reichelt (MATLAB
+    ode23s): each step solves with W = I - d * dt * J, for the Jacobian
+    J of derivs, so stiff modes stay stable at steps far beyond the
+    explicit limit.  A step costs 3 derivs calls (the last is reused by
+    the next step) and one inversion of W, which suits small systems.
+    J is reused across steps, and only evaluated again when a step with a
+    reused J is rejected.  Dense output is 2nd order.
+    Item                            Description
+    jacobian(state)                 Function returning the n x n Jacobian
+                                    array; by default it is estimated by
+                                    forward differences (n derivs calls)
+    n_jacobians                     Count of Jacobian evaluations
+    Other items as for Adaptive.
+
+    >>> def derivs(y):
+    ...     return numpy.array([-1000. * y[0] + y[1], -y[1]])
+    >>> integrator = Rosenbrock(derivs, 2, rtol=1e-4, atol=1e-8)
+    >>> integrator.reset(0., [1., 1.])
+    >>> y = integrator.advance(10.)
+    >>> print abs(y[1] / numpy.exp(-10.) - 1.) < 1e-2
+    True
+    >>> print integrator.n_steps, integrator.n_evals, integrator.n_jacobians
+    157 318 1
+
+    DormandPrince needs 3038 steps for this, held back by the stiff mode.
+
+    """
+
+    d = 1. / (2. + math.sqrt(2.))
+    e32 = 6. + math.sqrt(2.)
+
+    def __init__(self, derivs, n, ylims=None, rtol=1e-3, atol=1e-6,
+                 dt=None, dt_max=None, list_derivs=False, jacobian=None):
+        Adaptive.__init__(self, derivs, n, ylims, rtol, atol, dt, dt_max,
+                          list_derivs)
+        self.jacobian = jacobian
+        self.n_jacobians = 0
+        self._identity = numpy.eye(n)
+        self._jac = None
+        self._jac_fresh = False
+        self._f0 = None
+
+    def reset(self, t, y):
+        """Start from state y at time t (the step size and Jacobian are
+        kept)"""
+        Adaptive.reset(self, t, y)
+        self._jac_fresh = False
+
+    def _update_jacobian(self):
+        """Evaluate the Jacobian at the state"""
+        self.n_jacobians += 1
+        y = self.y
+        if self.jacobian is not None:
+            self._jac = numpy.array(self.jacobian(y), dtype=numpy.float64)
+        else:
+            jac = numpy.empty((len(y), len(y)))
+            delta = numpy.sqrt(numpy.finfo(numpy.float64).eps) \
+                * numpy.maximum(numpy.abs(y), self.atol / self.rtol)
+            for j in range(len(y)):
+                y_j = y.copy()
+                y_j[j] += delta[j]
+                jac[:, j] = (numpy.asarray(self._derivs(y_j)) - self._f0) \
+                    / (y_j[j] - y[j])
+            self._jac = jac
+        self._jac_fresh = True
+
+    def step(self, t_stop=None):
+        """Take one accepted step, ending at t_stop at the latest, and
+        return the new time"""
+        y = self.y
+        d = self.d
+        if not self._f_fresh:
+            self._f0 = numpy.array(self._derivs(y), dtype=numpy.float64)
+            self._f_fresh = True
+        f0 = self._f0
+        if self._jac is None:
+            self._update_jacobian()
+        if self.dt is None:
+            self.dt = self._initial_dt(f0, 2)
+        while True:
+            dt, truncated = self._step_size(t_stop)
+            w_inv = numpy.linalg.inv(self._identity - (d * dt) * self._jac)
+            k1 = numpy.dot(w_inv, f0)
+            f1 = numpy.asarray(self._derivs(y + (0.5 * dt) * k1))
+            k2 = numpy.dot(w_inv, f1 - k1) + k1
+            y_new = y + dt * k2
+            f2 = numpy.array(self._derivs(y_new), dtype=numpy.float64)
+            k3 = numpy.dot(w_inv, f2 - self.e32 * (k2 - f1) - 2. * (k1 - f0))
+            error_norm = self._error_norm((dt / 6.) * (k1 - 2. * k2 + k3),
+                                          y, y_new)
+            if error_norm <= 1.:
+                break
+            if not self._jac_fresh:
+                # Retry with a Jacobian at this state before shrinking.
+                self.n_rejected += 1
+                self._update_jacobian()
+                continue
+            self._reject(dt, max(0.2, 0.8 * error_norm ** (-1. / 3)))
+
+        if error_norm == 0.:
+            factor = 5.
+        else:
+            factor = min(5., 0.8 * error_norm ** (-1. / 3))
+        self._y_old = y
+        self._k1 = k1
+        self._k2 = k2
+        if self._accept(y_new, dt, truncated, factor):
+            self._f_fresh = False
+        else:
+            self._f0 = f2
+        self._jac_fresh = False
+        self.y = y_new
+        return self.t
+
+    def dense(self, t):
+        """Return the state at time t within the last step"""
+        self._check_dense(t)
+        if t == self.t:
+            return self.y.copy()
+        x = (t - self._t_old) / self._dt_old
+        d = self.d
+        y = self._y_old + self._dt_old * (
+            (x * (1. - x) / (1. - 2. * d)) * self._k1
+            + (x * (x - 2. * d) / (1. - 2. * d)) * self._k2)
+        if self.limits is not None:
+            numpy.clip(y, self.limits[0], self.limits[1], y)
+        return y
+
+
+if __name__ == '__main__':
+    import sys
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""sweep.py    Parallel parameter sweeps of simulations
+18-Oct-2026  DA Gutz  Created
+
+grid makes the cases of a full factorial sweep.  run_sweep runs a case
+function on each of them in a pool of worker processes, each case writing to
+its own results file.  Data loaded once by a setup function (e.g. the lookup
+tables of a model) are shared by the cases:  setup runs in the parent before
+the workers fork, so they share its memory copy-on-write; where processes
+cannot fork, setup runs once in each worker instead.  A case that raises is
+recorded with its traceback and the sweep carries on.  The wall time of every
+case is reported in a summary file.
+
+>>> cases = grid([('alt', [0, 3000]), ('gvw', [40000, 46000])])
+>>> for case in cases: print sorted(case.items())
+[('alt', 0), ('gvw', 40000)]
+[('alt', 0), ('gvw', 46000)]
+[('alt', 3000), ('gvw', 40000)]
+[('alt', 3000), ('gvw', 46000)]
+
+>>> import shutil, tempfile
+>>> path = tempfile.mkdtemp()
+>>> results = run_sweep(_example_case, cases, _example_setup, workers=2,
+...                     output_dir=path)
+>>> for r in results: print r['index'], r['result'], r['error'] is None
+0 0.0 True
+1 6.0 True
+2 3.0 True
+3 None False
+>>> print results[3]['error'].splitlines()[-1]
+ValueError: too heavy
+>>> print open(results[1]['path']).read(),
+alt= 0 gvw= 46000
+>>> lines = open(os.path.join(path, 'sweep.csv')).read().splitlines()
+>>> print lines[0]
+index,alt,gvw,path,wall_time,result,error
+>>> len(lines)
+5
+>>> shutil.rmtree(path)
+
+The doctests can be run by running this script directly with Python:
+python sweep.py
+
+"""
+import csv
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+
+class Error(Exception):
+    """Sweep Error"""
+    pass
+
+
+# Data returned by the setup function, shared by the cases of a sweep
+_shared = None
+
+
+def grid(axes):
+    """Full factorial cases of the [(name, values), ...] axes, as a list of
+    {name: value} dicts, the last axis varying fastest"""
+    cases = [{}]
+    for (name, values) in axes:
+        if not len(values):
+            raise Error('no values for %s' % name)
+        cases = [dict(case, **{name: value})
+                 for case in cases for value in values]
+    return cases
+
+
+def _initialize(setup):
+    """Pool initializer:  run setup in a worker that did not fork from the
+    parent holding its data"""
+    global _shared
+    if _shared is None and setup is not None:
+        _shared = setup()
+
+
+def _run_case((case_func, index, case, path)):
+    """Run one case into its own results file, timing it and catching any
+    failure.  Return (index, wall_time, result, error)"""
+    start = time.time()
+    result = None
+    error = None
+    try:
+        results_file = open(path, 'wb')
+        try:
+            result = case_func(case, _shared, results_file)
+        finally:
+            results_file.close()
+    except Exception:
+        error = traceback.format_exc()
+    return index, time.time() - start, result, error
+
+
+def run_sweep(case_func, cases, setup=None, workers=None, output_dir='.',
+              prefix='case', suffix='.csv', summary='sweep.csv',
+              verbose=False):
+    """Run case_func(case, shared, results_file) for each case dict in a pool
+    of worker processes, where shared is what setup() returned (None without
+    setup) and results_file is open on prefix<index>suffix in output_dir.
+    case_func must be importable (module level) to reach the workers.
+
+    workers defaults to the number of CPUs; workers=1 runs in this process.
+    Return, in case order, a list of dicts with the index, case, path,
+    wall_time (s), result (case_func return) and error (traceback text, None
+    on success).  The same is written to the summary csv in output_dir,
+    unless summary is None.
+    """
+    global _shared
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if workers < 1:
+        raise Error('workers=%s must be at least 1' % workers)
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    width = len(str(max(len(cases) - 1, 0)))
+    jobs = [(case_func, i, case,
+             os.path.join(output_dir, '%s%0*d%s' % (prefix, width, i, suffix)))
+            for (i, case) in enumerate(cases)]
+
+    # Load the shared data before forking, so the workers inherit it
+    forks = hasattr(os, 'fork')
+    if setup is not None and (forks or workers == 1):
+        _shared = setup()
+    results = [None] * len(jobs)
+    try:
+        if workers == 1:
+            done = (_run_case(job) for job in jobs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(
+                min(workers, max(len(jobs), 1)), _initialize,
+                (None if forks else setup,))
+            done = pool.imap_unordered(_run_case, jobs)
+        try:
+            for (index, wall_time, result, error) in done:
+                results[index] = {'index': index, 'case': cases[index],
+                                  'path': jobs[index][3],
+                                  'wall_time': wall_time, 'result': result,
+                                  'error': error}
+                if verbose:
+                    status = error and 'FAILED' or 'ok'
+                    print 'case %d %s %.3f s %s' % (index, cases[index],
+                                                   wall_time, status)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+    finally:
+        _shared = None
+
+    if summary is not None:
+        write_summary(results, os.path.join(output_dir, summary))
+    return results
+
+
+def write_summary(results, path):
+    """Write the run_sweep results to csv file path, one row per case with
+    its parameters, path, wall time, result and the last line of any error"""
+    names = []
+    for r in results:
+        for name in sorted(r['case']):
+            if name not in names:
+                names.append(name)
+    summary_file = open(path, 'wb')
+    try:
+        writer = csv.writer(summary_file)
+        writer.writerow(['index'] + names +
+                        ['path', 'wall_time', 'result', 'error'])
+        for r in results:
+            error = r['error'] and r['error'].strip().splitlines()[-1] or ''
+            writer.writerow([r['index']] +
+                            [r['case'].get(name, '') for name in names] +
+                            [r['path'], '%.6f' % r['wall_time'],
+                             r['result'], error])
+    finally:
+        summary_file.close()
+
+
+def _example_setup():
+    """Doctest setup:  the shared data"""
+    return {'scale': 1e-3}
+
+
+def _example_case(case, shared, results_file):
+    """Doctest case"""
+    if case['alt'] and case['gvw'] > 45000:
+        raise ValueError('too heavy')
+    results_file.write('alt= %(alt)s gvw= %(gvw)s\n' % case)
+    return (case['alt'] + case['gvw'] - 40000) * shared['scale']
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
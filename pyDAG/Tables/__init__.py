@@ -1 +1,2 @@
 from lookup_table import LookupTable
+from scattered_table import ScatteredTable
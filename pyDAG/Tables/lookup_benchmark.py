@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""lookup_benchmark.py    Timing of LookupTable interpolation kernels
+
+benchmark_kernels compares the recursive kernel (interp_n, or
+interp_strided for array storage) with the corner-weight kernel
+(interp_corners) for tables of 1 to 6 dimensions.
+
+benchmark_uniform compares the binary search with the direct interval
+calculation for evenly spaced axes in batched lookups, on the rotorCurves
+load tables.
+
+benchmark_suite times table setup, lookup(), compiled and batched
+lookups, at interior and extrapolated points, for 1 to 6 dimensions and
+5 to 100 breakpoints per axis, and writes the results as CSV rows to
+compare between releases.
+
+python lookup_benchmark.py
+python lookup_benchmark.py --suite results.csv [--label release]
+                           [--max-values n] [--number n]
+
+"""
+import csv
+import getopt
+import os
+import platform
+import sys
+import timeit
+from lookup_table import LookupTable
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for array storage and the batched lookups.
+    numpy = None
+
+# Columns of the benchmark_suite results
+SUITE_FIELDS = ['label', 'python', 'numpy', 'benchmark', 'point', 'n_dims',
+                'n_points', 'storage', 'usec']
+
+ROTOR_CURVES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, 'Apps', 'RotorDynamicModel',
+                            'rotorCurves.txt')
+
+
+def make_table(n_dims, n_points, storage='list', kernel='recursive'):
+    """Return a table of n_dims axes with n_points breakpoints each.
+
+    The values are a smooth non-linear function of the axis values, and
+    the axes are named x0, x1, ...
+
+    """
+    lut = LookupTable(storage=storage, kernel=kernel)
+    for axis_i in range(n_dims):
+        lut.addAxis('x%d' % axis_i, make_axis(n_points))
+    lut.setValueTable(make_values(n_dims, n_points))
+    return lut
+
+
+def make_axis(n_points):
+    """Return the (unevenly spaced) breakpoints used by make_table."""
+    return [float(i * i) for i in range(n_points)]
+
+
+def make_values(n_dims, n_points):
+    """Return the nested value lists used by make_table."""
+    axis_values = make_axis(n_points)
+
+    def build(depth, total):
+        if depth == n_dims:
+            return total * total + 1.
+        return [build(depth + 1, total + x * (depth + 1))
+                for x in axis_values]
+    return build(0, 0.)
+
+
+def time_lookup(lut, point, number):
+    """Return the mean time of lut.lookup(**point), in microseconds."""
+    timer = timeit.Timer(lambda: lut.lookup(**point))
+    return min(timer.repeat(3, number)) / number * 1e6
+
+
+def benchmark_kernels(dims=range(1, 7), n_points=5, number=2000,
+                      out=sys.stdout):
+    """Time the recursive and corner kernels for each number of dimensions.
+
+    Both storages are timed (array storage only with numpy).  Returns a
+    list of (n_dims, storage, kernel, usec_per_lookup) tuples.
+
+    """
+    storages = ['list']
+    if numpy is not None:
+        storages.append('array')
+    results = []
+    out.write('%6s %8s %10s %12s\n' % ('n_dims', 'storage', 'kernel',
+                                        'usec/lookup'))
+    for n_dims in dims:
+        point = dict([('x%d' % axis_i, 1.3 + axis_i)
+                      for axis_i in range(n_dims)])
+        for storage in storages:
+            for kernel in ('recursive', 'corner'):
+                lut = make_table(n_dims, n_points, storage, kernel)
+                usec = time_lookup(lut, point, number)
+                results.append((n_dims, storage, kernel, usec))
+                out.write('%6d %8s %10s %12.2f\n' % (n_dims, storage, kernel,
+                                                     usec))
+    return results
+
+
+def load_rotor_curves(path=ROTOR_CURVES):
+    """Return (axes, columns) read from a rotorCurves.txt file.
+
+    axes -- [alt_t, vknot_t, oatf_t, gvw_t, clp_t] breakpoints
+    columns -- {'HPTOT_T': [...], 'HPMR_T': [...], 'HPTR_T': [...]} values in
+               file order (alt outermost, clp innermost)
+
+    """
+    lines = open(path).readlines()
+    names = lines[0].split()
+    rows = [[float(token) for token in line.split()]
+            for line in lines[1:] if line.split()]
+    axes = []
+    for axis_i in range(5):
+        axis = []
+        for row in rows:
+            if row[axis_i] not in axis:
+                axis.append(row[axis_i])
+        axes.append(axis)
+    columns = {}
+    for column_i in range(5, len(names)):
+        columns[names[column_i]] = [row[column_i] for row in rows]
+    return axes, columns
+
+
+def rotor_table(axes, values, alt_i=0, vknot_i=0, uniform=True,
+                clp_refine=1):
+    """Return the (oatf, gvw, clp) table for one alt and vknot breakpoint.
+
+    clp_refine -- subdivide each clp interval this many times (by linear
+                  interpolation, so lookups are unchanged) to try denser
+                  axes
+
+    """
+    oatf_t, gvw_t, clp_t = axes[2:]
+    n_slice = len(oatf_t) * len(gvw_t) * len(clp_t)
+    start = (alt_i * len(axes[1]) + vknot_i) * n_slice
+    coarse = LookupTable(storage='array')
+    coarse.addAxis('oatf', oatf_t)
+    coarse.addAxis('gvw', gvw_t)
+    coarse.addAxis('clp', clp_t)
+    coarse.setValueTable(values[start:start + n_slice])
+
+    step = (clp_t[1] - clp_t[0]) / clp_refine
+    fine_clp_t = [clp_t[0] + i * step
+                  for i in range((len(clp_t) - 1) * clp_refine + 1)]
+    lut = LookupTable(uniform=uniform)
+    lut.addAxis('oatf', oatf_t)
+    lut.addAxis('gvw', gvw_t)
+    lut.addAxis('clp', fine_clp_t)
+    lut.setValueTable([[[coarse.lookup(oatf=oatf, gvw=gvw, clp=clp)
+                         for clp in fine_clp_t]
+                        for gvw in gvw_t]
+                       for oatf in oatf_t])
+    return lut
+
+
+def benchmark_uniform(path=ROTOR_CURVES, refinements=(1, 10, 100),
+                      n_lookups=100000, out=sys.stdout):
+    """Time batched lookups with and without the evenly spaced axis path.
+
+    All the rotorCurves (oatf, gvw, clp) axes are evenly spaced.  The clp
+    axis is also refined, to show how the gain grows with the number of
+    breakpoints.  Returns a list of
+    (n_clp, usec_binary_search, usec_uniform) tuples, per lookup.
+
+    This requires numpy.
+
+    """
+    axes, columns = load_rotor_curves(path)
+    oatf_t, gvw_t, clp_t = axes[2:]
+    points = {'oatf': numpy.random.uniform(oatf_t[0], oatf_t[-1], n_lookups),
+              'gvw': numpy.random.uniform(gvw_t[0], gvw_t[-1], n_lookups),
+              'clp': numpy.random.uniform(clp_t[0], clp_t[-1], n_lookups)}
+    results = []
+    out.write('%6s %12s %12s %8s\n' % ('n_clp', 'bisect usec', 'uniform usec',
+                                      'speedup'))
+    for clp_refine in refinements:
+        usecs = []
+        for uniform in (False, True):
+            lut = rotor_table(axes, columns['HPTOT_T'], uniform=uniform,
+                              clp_refine=clp_refine)
+            timer = timeit.Timer(lambda: lut.lookup_many(**points))
+            usecs.append(min(timer.repeat(3, 1)) / n_lookups * 1e6)
+        n_clp = len(lut.axes[2])
+        results.append((n_clp, usecs[0], usecs[1]))
+        out.write('%6d %12.3f %12.3f %8.2f\n'
+                  % (n_clp, usecs[0], usecs[1], usecs[0] / usecs[1]))
+    return results
+
+
+def suite_points(n_dims, n_points):
+    """Return {'interior': point, 'extrapolated': point} for make_table.
+
+    The interior point is inside a cell on every axis, and the
+    extrapolated one beyond the last breakpoint of every axis.
+
+    """
+    axis = make_axis(n_points)
+    width = axis[-1] - axis[0]
+    interior = {}
+    extrapolated = {}
+    for axis_i in range(n_dims):
+        interior['x%d' % axis_i] = axis[0] + 0.37 * width
+        extrapolated['x%d' % axis_i] = axis[-1] + 0.1 * width
+    return {'interior': interior, 'extrapolated': extrapolated}
+
+
+def benchmark_suite(dims=range(1, 7), sizes=(5, 10, 20, 50, 100),
+                    max_values=100000, number=1000, n_batch=10000,
+                    label='', out=sys.stdout):
+    """Time table setup and lookups over dimensions and axis sizes.
+
+    Each table of n_dims axes with n_points breakpoints (make_table) with
+    at most max_values values is timed, for each storage:
+    setup -- addAxis and setValueTable from nested lists
+    compile -- LookupTable.compile()
+    lookup, compiled -- one lookup, at the interior and the extrapolated
+                        point (suite_points)
+    lookup_many -- per point of a batch of n_batch points around the
+                   interior or the extrapolated point
+
+    A CSV row (SUITE_FIELDS) is written to the out file for each time,
+    in microseconds, with the label (e.g. a release) and the Python and
+    numpy versions.  Array storage and batched lookups are skipped
+    without numpy.  Returns the rows as dicts.
+
+    """
+    writer = csv.DictWriter(out, SUITE_FIELDS)
+    writer.writerow(dict(zip(SUITE_FIELDS, SUITE_FIELDS)))
+    numpy_version = numpy is not None and numpy.__version__ or ''
+    storages = ['list']
+    if numpy is not None:
+        storages.append('array')
+    rows = []
+
+    def record(benchmark, point, n_dims, n_points, storage, usec):
+        row = {'label': label, 'python': platform.python_version(),
+               'numpy': numpy_version, 'benchmark': benchmark,
+               'point': point, 'n_dims': n_dims, 'n_points': n_points,
+               'storage': storage, 'usec': '%.4g' % usec}
+        writer.writerow(row)
+        rows.append(row)
+
+    for n_dims in dims:
+        for n_points in sizes:
+            if n_points ** n_dims > max_values:
+                continue
+            axis = make_axis(n_points)
+            values = make_values(n_dims, n_points)
+            points = suite_points(n_dims, n_points)
+            for storage in storages:
+                def setup():
+                    lut = LookupTable(storage=storage)
+                    for axis_i in range(n_dims):
+                        lut.addAxis('x%d' % axis_i, axis)
+                    lut.setValueTable(values)
+                    return lut
+                lut = setup()
+                record('setup', '', n_dims, n_points, storage,
+                       min(timeit.Timer(setup).repeat(3, 1)) * 1e6)
+                record('compile', '', n_dims, n_points, storage,
+                       min(timeit.Timer(lut.compile).repeat(3, 1)) * 1e6)
+                compiled = lut.compile()
+                for point_name in ('interior', 'extrapolated'):
+                    point = points[point_name]
+                    record('lookup', point_name, n_dims, n_points, storage,
+                           time_lookup(lut, point, number))
+                    args = [point['x%d' % axis_i]
+                            for axis_i in range(n_dims)]
+                    timer = timeit.Timer(lambda: compiled(*args))
+                    record('compiled', point_name, n_dims, n_points, storage,
+                           min(timer.repeat(3, number)) / number * 1e6)
+                    if numpy is None:
+                        continue
+                    spread = 0.1 * (axis[-1] - axis[0])
+                    batch = {}
+                    for axis_name, axis_value in point.items():
+                        batch[axis_name] = axis_value + numpy.random.uniform(
+                            -spread, spread, n_batch)
+                    timer = timeit.Timer(lambda: lut.lookup_many(**batch))
+                    record('lookup_many', point_name, n_dims, n_points,
+                           storage, min(timer.repeat(3, 1)) / n_batch * 1e6)
+    return rows
+
+
+def usage(code, msg=''):
+    """Print the usage and exit with code."""
+    print >> sys.stderr, __doc__
+    if msg:
+        print >> sys.stderr, msg
+    sys.exit(code)
+
+
+def main(argv):
+    """Run the benchmarks, or the suite with --suite results.csv."""
+    try:
+        options, remainder = getopt.getopt(argv, 'h', ['help', 'suite=',
+                                                       'label=',
+                                                       'max-values=',
+                                                       'number='])
+    except getopt.GetoptError:
+        usage(2, 'getopt error')
+    suite_path = None
+    kwargs = {}
+    for opt, arg in options:
+        if opt in ('-h', '--help'):
+            usage(0)
+        elif opt == '--suite':
+            suite_path = arg
+        elif opt == '--label':
+            kwargs['label'] = arg
+        elif opt == '--max-values':
+            kwargs['max_values'] = int(arg)
+        elif opt == '--number':
+            kwargs['number'] = int(arg)
+    if suite_path is None:
+        benchmark_kernels()
+        if numpy is not None:
+            benchmark_uniform()
+        return
+    out = open(suite_path, 'wb')
+    try:
+        benchmark_suite(out=out, **kwargs)
+    finally:
+        out.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
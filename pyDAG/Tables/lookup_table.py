@@ -14,7 +14,8 @@
 # See http://www.fsf.org/licensing/licenses/lgpl.txt for full license text.
 """Define a multidimensional lookup table class.
 
-This uses (piecewise) linear interpolation for table lookups.
+This uses (piecewise) linear interpolation for table lookups, or
+optionally piecewise cubic (PCHIP, Akima or natural spline) along chosen axes.
 
 - axes are defined in order, and can be added in stages
 - axes are either purely increasing or purely decreasing
@@ -41,8 +42,43 @@ __author__ = 'Tim Wegener <twegener@radlogic.com.au>'
 __version__ = '$Revision: 1.1 $'
 __date__ = '$Date: 2010/12/17 13:15:02 $'
 
+import struct
 from bisect import bisect_right
 
+try:
+    from collections import OrderedDict
+except ImportError:
+    # OrderedDict is only needed for the lookup memo (Python 2.7 on).
+    OrderedDict = None
+
+try:
+    import json
+except ImportError:
+    # json is only needed to save and load tables (Python 2.6 on).
+    json = None
+
+try:
+    import numpy
+except ImportError:
+    # numpy is only needed for the batched (array) lookups.
+    numpy = None
+
+
+# Binary file format written by LookupTable.save
+FILE_MAGIC = 'PYDAGLUT'
+FILE_VERSION = 1
+
+# Interpolation methods for LookupTable.setInterpMethod
+INTERP_METHODS = ('linear', 'pchip', 'akima', 'spline')
+
+# Extrapolation policies for LookupTable.setExtrapolation
+EXTRAPOLATION_POLICIES = ('linear', 'clamp', 'raise', 'nan')
+
+# Storage dtypes of the value tables and axes (see LookupTable)
+STORAGE_DTYPES = ('float64', 'float32', 'int16', 'int32')
+
+NAN = float('nan')
+
 
 class Error(Exception):
     """Lookup Table Error"""
@@ -275,9 +311,562 @@ class LookupTable:
     >>> print lut.lookup(x=2.4, y=1.1, z=3.3)
     22.3
 
+    Batched lookups (requires numpy):
+
+    >>> xs = [2.4, 1., 5., 0.2, 6., 3.]
+    >>> ys = [1.1, 1., 5., 0.1, 5.5, 2.]
+    >>> zs = [3.3, 1., 5., -0.3, 7., 2.5]
+    >>> values = lut.lookup_many(x=xs, y=ys, z=zs)
+    >>> print values.shape
+    (6,)
+    >>> values.tolist() == [lut.lookup(x=x, y=y, z=z)
+    ...                     for x, y, z in zip(xs, ys, zs)]
+    True
+
+    Scalars are broadcast against arrays:
+
+    >>> print lut.lookup_many(x=2.4, y=1.1, z=[3.3, 4.3]).tolist()
+    [22.3, 26.3]
+    >>> print lut.lookup_many(x=2.4, y=1.1, z=3.3)
+    22.3
+
+    The results match lookup() exactly, including the extrapolation:
+
+    >>> lut = LookupTable()
+    >>> x_axis_values = [1., 2., 3., 4., 5.]
+    >>> y_axis_values = [1., 2., 3., 4., 5.]
+    >>> lut.addAxis('x', x_axis_values)
+    >>> lut.addAxis('y', y_axis_values)
+    >>> lut.setValueTable([[example_2var_func(x, y) for y in y_axis_values]
+    ...                    for x in x_axis_values])
+    >>> xs = [2.625, 2., 3., 1., 5., 0.2, 6.]
+    >>> ys = [1.1, 1.1, 1.1, 1., 5., 0.1, 5.5]
+    >>> values = lut.lookup_many(x=xs, y=ys)
+    >>> values.tolist() == [lut.lookup(x=x, y=y) for x, y in zip(xs, ys)]
+    True
+
+    >>> lut.lookup_many(x=xs)
+    Traceback (most recent call last):
+    Error: No axis value for 'y'
+
+    Evenly spaced axes are detected when they are added, and lookup_many
+    finds their intervals with one multiply instead of a binary search:
+
+    >>> print uniformSpacing(x_axis_values), uniformSpacing([1., 2., 4.])
+    (1.0, 1.0) None
+    >>> lut_b = LookupTable(uniform=False)
+    >>> lut_b.addAxis('x', x_axis_values)
+    >>> lut_b.addAxis('y', y_axis_values)
+    >>> lut_b.setValueTable(lut.value_table)
+    >>> (lut_b.lookup_many(x=xs, y=ys) == values).all()
+    True
+
+    Array storage (requires numpy):
+
+    The value table is held in one contiguous float64 array shaped by the
+    axes.  A flat sequence (in C order) may be given as well.
+
+    >>> lut_a = LookupTable(storage='array')
+    >>> lut_a.addAxis('x', x_axis_values)
+    >>> lut_a.addAxis('y', y_axis_values)
+    >>> lut_a.setValueTable([example_2var_func(x, y) for x in x_axis_values
+    ...                      for y in y_axis_values])
+    >>> print lut_a.value_table.shape, lut_a.value_table.dtype
+    (5, 5) float64
+    >>> print lut_a.value_table.flags['C_CONTIGUOUS']
+    True
+    >>> print lut_a.lookup(x=2.625, y=1.1)
+    9.55
+    >>> [lut_a.lookup(x=x, y=y) for x, y in zip(xs, ys)] == values.tolist()
+    True
+    >>> (lut_a.lookup_many(x=xs, y=ys) == values).all()
+    True
+
+    >>> lut_a.setValueTable([1., 2., 3.])
+    Traceback (most recent call last):
+    Error: Value table size 3 does not match axes (5, 5)
+
+    Corner-weight kernel:
+
+    All 2^N corner weights are computed once and summed, instead of
+    recursing over the axes.  This agrees with the recursive kernel to
+    within rounding, for either storage.
+
+    >>> for storage in ('list', 'array'):
+    ...     lut_c = LookupTable(storage=storage, kernel='corner')
+    ...     lut_c.addAxis('x', x_axis_values)
+    ...     lut_c.addAxis('y', y_axis_values)
+    ...     lut_c.setValueTable([[example_2var_func(x, y)
+    ...                           for y in y_axis_values]
+    ...                          for x in x_axis_values])
+    ...     print lut_c.lookup(x=2.625, y=1.1), lut_c.lookup(x=0.2, y=0.1),
+    ...     print lut_c.lookup(x=6., y=5.5)
+    9.55 1.7 29.5
+    9.55 1.7 29.5
+
+    >>> LookupTable(kernel='spline')
+    Traceback (most recent call last):
+    Error: Unknown kernel: 'spline'
+
+    Compiled lookups:
+
+    compile() returns a function of positional axis values that skips
+    the keyword handling and checks of lookup(), with the same results.
+
+    >>> f = lut.compile()
+    >>> print f(2.625, 1.1), f(0.2, 0.1), f(6., 5.5)
+    9.55 1.7 29.5
+    >>> [f(x, y) for x, y in zip(xs, ys)] == values.tolist()
+    True
+
+    The argument order may be given by axis name:
+
+    >>> f_yx = lut.compile('y', 'x')
+    >>> print f_yx(1.1, 2.625)
+    9.55
+    >>> lut.compile('x', 'x')
+    Traceback (most recent call last):
+    Error: Need each of the 2 axis names exactly once
+
+    Hunt mode:
+
+    For slowly varying inputs the previous interval is checked before
+    searching, with the same results.
+
+    >>> lut.setHunt('x')
+    >>> lut.setHunt('y')
+    >>> sweep = [0.5 + 0.05 * i for i in range(110)]
+    >>> expected = [lut_b.lookup(x=x, y=7. - x) for x in sweep]
+    >>> [lut.lookup(x=x, y=7. - x) for x in sweep] == expected
+    True
+    >>> f = lut.compile()
+    >>> [f(x, 7. - x) for x in reversed(sweep)] == expected[::-1]
+    True
+
+    Multiple outputs:
+
+    Outputs added by name share the axes, and the interval search and
+    weights are computed once for all of them.  Each output gets the same
+    result as a table of its own.
+
+    >>> def example_2var_func2(x, y):
+    ...     return x * y
+    >>> for storage in ('list', 'array'):
+    ...     lut_m = LookupTable(storage=storage)
+    ...     lut_m.addAxis('x', x_axis_values)
+    ...     lut_m.addAxis('y', y_axis_values)
+    ...     lut_m.addOutput('f', [[example_2var_func(x, y)
+    ...                            for y in y_axis_values]
+    ...                           for x in x_axis_values])
+    ...     lut_m.addOutput('g', [[example_2var_func2(x, y)
+    ...                            for y in y_axis_values]
+    ...                           for x in x_axis_values])
+    ...     print lut_m.lookup(x=2.625, y=1.1), lut_m.compile()(6., 5.5)
+    (9.55, 2.8875) (29.5, 33.0)
+    (9.55, 2.8875) (29.5, 33.0)
+    >>> many_f, many_g = lut_m.lookup_many(x=xs, y=ys)
+    >>> (many_f == values).all()
+    True
+    >>> print lut_m.getOutputName(1), lut_m.validate()
+    g True
+    >>> lut_m.setValueTable(lut.value_table)
+    Traceback (most recent call last):
+    Error: Table has named outputs; use addOutput
+
+    Saving and loading:
+
+    Tables are saved in a compact binary file.  By default loading maps
+    the values from the file (numpy.memmap) instead of reading them.
+
+    >>> import os, shutil, tempfile
+    >>> save_dir = tempfile.mkdtemp()
+    >>> lut_m.save(os.path.join(save_dir, 'lut_m.lut'))
+    >>> lut_l = LookupTable.load(os.path.join(save_dir, 'lut_m.lut'))
+    >>> print type(lut_l.value_table).__name__, lut_l.value_table.shape
+    memmap (5, 5)
+    >>> print lut_l.lookup(x=2.625, y=1.1), lut_l.output_names['g']
+    (9.55, 2.8875) 1
+    >>> lut.save(os.path.join(save_dir, 'lut.lut'))
+    >>> lut_l = LookupTable.load(os.path.join(save_dir, 'lut.lut'), mmap=False)
+    >>> (lut_l.lookup_many(x=xs, y=ys) == values).all()
+    True
+    >>> print lut_l.getAxisName(1), lut_l.axes[1]
+    y [1.0, 2.0, 3.0, 4.0, 5.0]
+
+    The interpolation methods and extrapolation policies of the axes are
+    kept:
+
+    >>> lut_c = LookupTable()
+    >>> lut_c.addAxis('x', [0., 1., 2., 3.])
+    >>> lut_c.setValueTable([0., 0., 1., 3.])
+    >>> for method in ('pchip', 'akima', 'spline'):
+    ...     lut_c.setInterpMethod('x', method)
+    ...     lut_c.save(os.path.join(save_dir, method + '.lut'))
+    ...     lut_l = LookupTable.load(os.path.join(save_dir, method + '.lut'))
+    ...     value = lut_l.lookup(x=1.5)
+    ...     print lut_l.interp_methods, value, value == lut_c.lookup(x=1.5)
+    ['pchip'] 0.333333333333 True
+    ['akima'] 0.375 True
+    ['spline'] 0.35 True
+    >>> for policy in ('clamp', 'nan'):
+    ...     lut_c.setExtrapolation('x', policy)
+    ...     lut_c.save(os.path.join(save_dir, policy + '.lut'))
+    ...     lut_l = LookupTable.load(os.path.join(save_dir, policy + '.lut'))
+    ...     print lut_l.extrapolation, lut_l.lookup_many(x=[-1., 1.5, 4.])
+    ['clamp'] [0.   0.35 3.  ]
+    ['nan'] [ nan 0.35  nan]
+    >>> lut_c.setExtrapolation('x', 'raise')
+    >>> lut_c.save(os.path.join(save_dir, 'raise.lut'))
+    >>> lut_l = LookupTable.load(os.path.join(save_dir, 'raise.lut'))
+    >>> print lut_l.extrapolation, lut_l.lookup(x=1.5)
+    ['raise'] 0.35
+    >>> lut_l.lookup(x=-1.)
+    Traceback (most recent call last):
+    Error: Value -1.0 out of range for axis 'x'
+    >>> del lut_l
+    >>> shutil.rmtree(save_dir)
+
+    Validation:
+
+    The result of validate() is kept until the axes or values are set
+    again.
+
+    >>> lut_v = LookupTable(storage='array')
+    >>> lut_v.addAxis('x')
+    >>> lut_v.setAxisValues('x', [1., 3., 2.])
+    >>> lut_v.addAxis('y', [1., 2.])
+    >>> lut_v.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> print lut_v.validate(), lut_v.validate()
+    False False
+    >>> lut_v.setAxisValues('y', [3., 4.])
+    Traceback (most recent call last):
+    Error: Cannot define axis once value table has been set.
+    >>> lut_v = LookupTable(storage='array')
+    >>> lut_v.addAxis('x', [3., 2., 1.])
+    >>> lut_v.addAxis('y', [1., 2.])
+    >>> lut_v.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> print lut_v.validate(), lut.validate(), lut_m.validate()
+    True True True
+
+    List tables are checked against the axis lengths too, outermost axis
+    first, so a non-square list table validates:
+
+    >>> lut_v = LookupTable()
+    >>> lut_v.addAxis('x', [1., 2., 3.])
+    >>> lut_v.addAxis('y', [1., 2.])
+    >>> lut_v.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> print lut_v.validate(), nestedSequenceSize(lut_v.value_table)
+    True (3, 2)
+    >>> lut_v = LookupTable()
+    >>> lut_v.addAxis('x', [1., 2.])
+    >>> lut_v.addAxis('y', [1., 2., 3.])
+    >>> lut_v.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> print lut_v.validate()
+    False
+
+    Cubic interpolation:
+
+    Along axes set to a piecewise cubic method the slopes at the
+    breakpoints are precomputed, so a coarse table follows a smooth
+    function much more closely than with linear interpolation.
+
+    >>> import math
+    >>> lut_s = LookupTable()
+    >>> lut_s.addAxis('x', [0.5 * i for i in range(7)])
+    >>> lut_s.setValueTable([math.sin(0.5 * i) for i in range(7)])
+    >>> fine = [0.01 * i for i in range(301)]
+    >>> def max_error(lut):
+    ...     return max([abs(lut.lookup(x=x) - math.sin(x)) for x in fine])
+    >>> print '%.4f' % max_error(lut_s)
+    0.0306
+    >>> for method in ('pchip', 'akima', 'spline'):
+    ...     lut_s.setInterpMethod('x', method)
+    ...     print method, '%.4f' % max_error(lut_s)
+    pchip 0.0138
+    akima 0.0058
+    spline 0.0018
+
+    PCHIP keeps monotone data monotone, where the spline overshoots:
+
+    >>> lut_s = LookupTable()
+    >>> lut_s.addAxis('x', [0., 1., 2., 3., 4., 5.])
+    >>> lut_s.setValueTable([0., 0., 0., 1., 1., 1.])
+    >>> fine = [0.01 * i for i in range(501)]
+    >>> for method in ('pchip', 'spline'):
+    ...     lut_s.setInterpMethod('x', method)
+    ...     many = lut_s.lookup_many(x=fine)
+    ...     print method, '%.3f %.3f' % (many.min(), many.max())
+    pchip 0.000 1.000
+    spline -0.109 1.109
+
+    Axes can be mixed, and lookup_many and compiled lookups give the same
+    results.  Outside the axis range the end slopes extrapolate linearly.
+
+    >>> lut_m.setInterpMethod('x', 'spline')
+    >>> print lut_m.lookup(x=2.625, y=1.1), lut_m.lookup(x=6., y=5.5)
+    (9.55, 2.8875) (29.5, 33.0)
+    >>> lut.setInterpMethod('y', 'akima')
+    >>> many = lut.lookup_many(x=xs, y=ys)
+    >>> [lut.lookup(x=x, y=y) for x, y in zip(xs, ys)] == many.tolist()
+    True
+    >>> f = lut.compile()
+    >>> [f(x, y) for x, y in zip(xs, ys)] == many.tolist()
+    True
+    >>> lut.setInterpMethod('y', 'cubic')
+    Traceback (most recent call last):
+    Error: Unknown interpolation method: 'cubic'
+
+    Gradients:
+
+    lookup_with_gradient() also returns the partial derivatives with
+    respect to each axis, taken from the same cell and weights.
+
+    >>> lut_s = LookupTable()
+    >>> lut_s.addAxis('x', [1., 2., 3., 4.])
+    >>> lut_s.addAxis('y', [0., 1.])
+    >>> lut_s.setValueTable([[x * x, x * x + 2.] for x in [1., 2., 3., 4.]])
+    >>> value, partials = lut_s.lookup_with_gradient(x=2.5, y=0.25)
+    >>> print value, partials[0], partials[1]
+    7.0 5.0 2.0
+    >>> lut_s.setInterpMethod('x', 'spline')
+    >>> value, partials = lut_s.lookup_with_gradient(x=2.5, y=0.25)
+    >>> print value, partials[0], partials[1]
+    6.7 5.0 2.0
+
+    The batched form gives the gradients at many points in one call:
+
+    >>> values, partials = lut_s.lookup_many_with_gradient(x=[1.5, 2.5, 5.],
+    ...                                                    y=0.25)
+    >>> print values, partials[0]
+    [ 2.85  6.7  23.9 ] [2.9 5.  7.4]
+    >>> values, partials = lut.lookup_many_with_gradient(x=xs, y=ys)
+    >>> (values == many).all(), len(partials)
+    (True, 2)
+
+    Extrapolation:
+
+    Beyond the ends of an axis lookups extrapolate linearly unless
+    another policy is set for the axis.  Out of range values are counted.
+
+    >>> lut_e = LookupTable()
+    >>> lut_e.addAxis('x', [1., 2., 3.])
+    >>> lut_e.setValueTable([10., 20., 40.])
+    >>> print lut_e.lookup(x=4.), lut_e.lookup(x=0.)
+    60.0 0.0
+    >>> lut_e.setExtrapolation('x', 'clamp')
+    >>> print lut_e.lookup(x=4.), lut_e.compile()(0.)
+    40.0 10.0
+    >>> print lut_e.lookup_many(x=[0., 2.5, 4.])
+    [10. 30. 40.]
+    >>> lut_e.setExtrapolation('x', 'nan')
+    >>> print lut_e.lookup(x=4.), lut_e.lookup(x=3.)
+    nan 40.0
+    >>> lut_e.setExtrapolation('x', 'raise')
+    >>> lut_e.lookup(x=4.)
+    Traceback (most recent call last):
+    Error: Value 4.0 out of range for axis 'x'
+    >>> print lut_e.getOutOfRangeCounts()
+    {'x': (3, 5)}
+    >>> lut_e.resetOutOfRangeCounts()
+    >>> print lut_e.getOutOfRangeCounts()
+    {'x': (0, 0)}
+    >>> lut_e.setExtrapolation('x', 'hold')
+    Traceback (most recent call last):
+    Error: Unknown extrapolation policy: 'hold'
+
+    Memo:
+
+    Results of repeated lookups can be kept, with the least recently used
+    ones dropped beyond the capacity.
+
+    >>> lut_e = LookupTable()
+    >>> lut_e.addAxis('x', [1., 2., 3.])
+    >>> lut_e.addAxis('y', [1., 2.])
+    >>> lut_e.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> lut_e.setMemo(capacity=2)
+    >>> for y in (1.5, 1.5, 1.25, 1.5, 1.75, 1.25):
+    ...     print lut_e.lookup(x=2., y=y),
+    3.5 3.5 3.25 3.5 3.75 3.25
+    >>> stats = lut_e.getMemoStats()
+    >>> print stats['hits'], stats['misses'], stats['evictions'], stats['size']
+    2 4 2 2
+
+    With a resolution, axis values rounding to the same multiple of it
+    share a result:
+
+    >>> lut_e.setMemo(capacity=100, resolution={'y': 0.5})
+    >>> print lut_e.lookup(x=2., y=1.6), lut_e.lookup(x=2., y=1.4)
+    3.6 3.6
+    >>> lut_e.setValueTable([[1., 2.], [3., 4.], [5., 6.]])
+    >>> print lut_e.getMemoStats()['size'], lut_e.lookup(x=2., y=1.4)
+    0 3.4
+    >>> lut_e.resetMemoStats()
+    >>> lut_e.setMemo(None)
+    >>> stats = lut_e.getMemoStats()
+    >>> print stats['hits'], stats['misses'], stats['capacity']
+    0 0 0
+
+    Resampling and decimation:
+
+    resample() interpolates the table on new axes, and decimate() drops
+    the breakpoints that are not needed to reproduce it within a
+    tolerance.  Both report the errors at the original breakpoints.
+
+    >>> lut_e = LookupTable()
+    >>> lut_e.addAxis('x', [0., 1., 2., 3., 4.])
+    >>> lut_e.setValueTable([0., 1., 2., 3., 10.])
+    >>> lut_d, report = lut_e.decimate(1e-9)
+    >>> print lut_d.axes[0], lut_d.value_table, report['reduction']
+    [0.0, 3.0, 4.0] [0.0, 3.0, 10.0] 0.4
+    >>> lut_d, report = lut_d.resample({'x': [0., 2., 4.]})
+    >>> print lut_d.value_table, report['max_error'], report['rms_error']
+    [0.0, 2.0, 10.0] 3.0 1.73205080757
+    >>> print report['size'], report['original_size']
+    3 3
+
+    Building from a function:
+
+    from_function() evaluates a function at every point of the axes, in
+    chunks, optionally on a pool of processes (for a picklable function)
+    and keeping a checkpoint to resume from.
+
+    >>> import operator
+    >>> grid_axes = [('x', [1., 2., 3.]), ('y', [10., 20.])]
+    >>> lut_f = LookupTable.from_function(operator.mul, grid_axes, workers=2,
+    ...                                   chunk_size=2)
+    >>> print lut_f.value_table.tolist(), lut_f.lookup(x=1.5, y=15.)
+    [[10.0, 20.0], [20.0, 40.0], [30.0, 60.0]] 22.5
+    >>> save_dir = tempfile.mkdtemp()
+    >>> calls = []
+    >>> def sum_and_difference(x, y):
+    ...     calls.append((x, y))
+    ...     return x + y, x - y
+    >>> checkpoint = os.path.join(save_dir, 'lut_f.npy')
+    >>> lut_f = LookupTable.from_function(sum_and_difference, grid_axes,
+    ...                                   checkpoint=checkpoint,
+    ...                                   outputs=['sum', 'difference'])
+    >>> print len(calls), lut_f.lookup(x=1.5, y=15.)
+    6 (16.5, -13.5)
+    >>> lut_f = LookupTable.from_function(sum_and_difference, grid_axes,
+    ...                                   checkpoint=checkpoint,
+    ...                                   outputs=['sum', 'difference'])
+    >>> print len(calls), lut_f.lookup(x=1.5, y=15.)
+    6 (16.5, -13.5)
+
+    A checkpoint left by other axes or another function is not resumed:
+
+    >>> for func, other_axes in ((sum_and_difference,
+    ...                           [('x', [1., 2., 4.]), ('y', [10., 20.])]),
+    ...                          (lambda x, y: (y, x), grid_axes)):
+    ...     try:
+    ...         LookupTable.from_function(func, other_axes,
+    ...                                   checkpoint=checkpoint,
+    ...                                   outputs=['sum', 'difference'])
+    ...     except Error, error:
+    ...         print str(error).replace(save_dir, '...')
+    Checkpoint '.../lut_f.npy' is for another table, function or chunk size
+    Checkpoint '.../lut_f.npy' is for another table, function or chunk size
+    >>> del lut_f
+    >>> shutil.rmtree(save_dir)
+
+    Storage dtypes:
+
+    Values (and breakpoints) can be stored in single precision, or as
+    fixed point integer codes with a scale and offset.  Single precision
+    tables interpolate in float32 arithmetic.
+
+    >>> lut_s = LookupTable(storage='array', dtype='float32')
+    >>> lut_s.addAxis('x', [0., 1., 2., 4.])
+    >>> lut_s.setValueTable([0., 0.1, 0.4, 1.6])
+    >>> print repr(lut_s.lookup(x=0.3)), lut_s.value_table.nbytes
+    0.030000001192092896 16
+    >>> print lut_s.lookup_many(x=[0.3, 3.]).dtype
+    float32
+    >>> lut_q = LookupTable(storage='array', dtype='int16')
+    >>> lut_q.addAxis('x', [0., 1., 2., 4.])
+    >>> lut_q.setValueTable([0., 0.1, 0.4, 1.6], scale=0.001, offset=0.)
+    >>> print lut_q.value_table, lut_q.value_scaling, lut_q.lookup(x=1.5)
+    [   0  100  400 1600] [(0.001, 0.0)] 0.25
+    >>> lut_q.setValueTable([0., 0.1, 0.4, 40.], scale=0.001, offset=0.)
+    Traceback (most recent call last):
+    Error: Values out of range of int16 with scale 0.001 and offset 0.0
+    >>> LookupTable(dtype='float32')
+    Traceback (most recent call last):
+    Error: dtype float32 requires array storage
+
+    Freezing:
+
+    A frozen table is immutable, so threads can share it without locks.
+
+    >>> lut_z = LookupTable()
+    >>> lut_z.addAxis('x', [0., 1., 2.])
+    >>> lut_z.addAxis('y', [0., 10.])
+    >>> lut_z.setValueTable([[0., 1.], [2., 3.], [4., 8.]])
+    >>> lut_z.freeze()
+    >>> print lut_z.frozen, lut_z.value_table, lut_z.lookup(x=1.5, y=5.)
+    True ((0.0, 1.0), (2.0, 3.0), (4.0, 8.0)) 4.25
+    >>> lut_z.setValueTable([[0., 1.], [2., 3.], [4., 9.]])
+    Traceback (most recent call last):
+    Error: Table is frozen
+    >>> lut_s.setMemo(10)
+    >>> lut_s.freeze()
+    Traceback (most recent call last):
+    Error: Cannot freeze a table with a memo
+    >>> lut_s.setMemo(None)
+    >>> lut_s.freeze()
+    >>> lut_s.value_table[0] = 1.
+    Traceback (most recent call last):
+    ValueError: assignment destination is read-only
+
     """
 
-    def __init__(self):
+    def __init__(self, storage='list', kernel='recursive', uniform=True,
+                 dtype='float64', axis_dtype='float64'):
+        """Create an empty table.
+
+        storage -- 'list' to keep the value table as given (nested sequences)
+                   'array' to store it as one contiguous numpy array
+                   (C-order, shape taken from the axes); corner values are
+                   then reached directly through the array strides
+        kernel -- 'recursive' to interpolate one axis at a time (interp_n)
+                  'corner' to compute the 2^N corner weights once and take
+                  a single weighted sum (interp_corners)
+        uniform -- in lookup_many, find intervals on evenly spaced axes
+                   with one multiply instead of a binary search (same
+                   results either way)
+        dtype -- storage dtype of the value tables (array storage only):
+                 'float64', 'float32', or 'int16' or 'int32' fixed point,
+                 value = code * scale + offset (see setValueTable)
+        axis_dtype -- dtype the breakpoints are rounded to, as for dtype
+                      (see addAxis)
+
+        Tables stored as float32 or int16 interpolate in float32
+        arithmetic (lookup then goes through lookup_many), as an embedded
+        target with single precision tables would; the others in float64.
+
+        """
+        if storage not in ('list', 'array'):
+            raise Error("Unknown storage: '%s'" % storage)
+        if storage == 'array' and numpy is None:
+            raise Error("Array storage requires numpy")
+        if kernel not in ('recursive', 'corner'):
+            raise Error("Unknown kernel: '%s'" % kernel)
+        for a_dtype in (dtype, axis_dtype):
+            if a_dtype not in STORAGE_DTYPES:
+                raise Error("Unknown dtype: '%s'" % a_dtype)
+            if a_dtype != 'float64' and storage != 'array':
+                raise Error("dtype %s requires array storage" % a_dtype)
+        self.storage = storage
+        self.kernel = kernel
+        self.uniform = uniform
+        self.dtype = dtype
+        self.axis_dtype = axis_dtype
+
+        # compute_dtype - float type of the interpolation arithmetic
+        if dtype in ('float32', 'int16'):
+            self.compute_dtype = 'float32'
+        else:
+            self.compute_dtype = 'float64'
 
         # axis_names - map name->index
         self.axis_names = {}  
@@ -291,41 +880,355 @@ class LookupTable:
         #    [[[val_x0_y0_...z0, val_x0_y0..._z1, ...], [], ...], ...]
         self.value_table = [] 
 
-    def addAxis(self, name, axis_values=None):
-        """Add an axis definition."""
+        # output_names - map name->index, for tables with named outputs
+        self.output_names = {}
+
+        # output_tables - value tables of the named outputs, all on the same
+        #                 axes; value_table is the first of them
+        self.output_tables = []
+
+        # value_scaling - (scale, offset) of each value table with an
+        #                 integer dtype, None for the others
+        self.value_scaling = []
+
+        # axis_scaling - (scale, offset) of each axis with an integer
+        #                axis_dtype, None for the others
+        self.axis_scaling = []
+
+        # _uniform - (start, 1 / step) for each evenly spaced increasing axis,
+        #            None for the others; lookup_many finds their intervals
+        #            directly instead of by binary search.  (For single
+        #            lookups the C bisect is faster than doing that in Python.)
+        self._uniform = []
+
+        # _hunt - interval start index of the previous lookup for each axis
+        #         in hunt mode (see setHunt), None for the others
+        self._hunt = []
+
+        # interp_methods - interpolation method along each axis (see
+        #                  setInterpMethod)
+        self.interp_methods = []
+
+        # extrapolation - policy beyond the ends of each axis (see
+        #                 setExtrapolation)
+        self.extrapolation = []
+
+        # _out_of_range - [below, above] counts of axis values beyond the
+        #                 ends of each axis (shared with compiled lookups)
+        self._out_of_range = []
+
+        # _memo - (capacity, resolution) of the lookup memo, None when off
+        #         (see setMemo); its entries are kept in _cache['memo']
+        self._memo = None
+
+        # _memo_stats - [hits, misses, evictions] of the memo
+        self._memo_stats = [0, 0, 0]
+
+        # _cubic_mask - bit (1 << axis_i) set for each axis with a cubic
+        #               interpolation method
+        self._cubic_mask = 0
+
+        # _cache - data derived from the axes and value table (e.g. numpy
+        #          copies for batched lookups), cleared whenever they are set
+        self._cache = {}
+
+        # frozen - True once the table is immutable (see freeze)
+        self.frozen = False
+
+    def addAxis(self, name, axis_values=None, scale=None, offset=None):
+        """Add an axis definition.
+
+        With an axis_dtype other than float64 the breakpoints are rounded
+        to it.  For the integer dtypes, scale and offset (by default fitted
+        to the range of the breakpoints) are as for setValueTable.
+
+        """
 
+        self._checkMutable()
         if self.axis_names.has_key(name):
             raise Error("Axis already exists with name: '%s'" % name)
+        axis_values, scaling = self._storedAxis(axis_values, scale, offset)
         axis_i = len(self.axes)
         self.axis_names[name] = axis_i
         self.axes.append(axis_values)
-
-    def setAxisValues(self, axis_name, axis_values):
+        self.axis_scaling.append(scaling)
+        self._uniform.append(self.uniform and uniformSpacing(axis_values)
+                             or None)
+        self._hunt.append(None)
+        self.interp_methods.append('linear')
+        self.extrapolation.append('linear')
+        self._out_of_range.append([0, 0])
+        self._cache.clear()
+
+    def setAxisValues(self, axis_name, axis_values, scale=None, offset=None):
         """Set the axis values for the specified axis.
 
         Axis values define points along the axis at which measurements
-        were taken.
+        were taken.  They are stored as for addAxis.
 
         This will raise an error if the value table already exists.
 
         # todo: Add doctests.
 
         """
+        self._checkMutable()
         # todo: Is raising an error here necessary?
-        if self.value_table is not None:
+        if len(self.value_table):
             raise Error("Cannot define axis once value table has been set.")
         axis_i = self.axis_names[axis_name]
 ##         if len(axis_values) != len(self.axes[axis_i]):
 ##             print 'warning: number of axis values changed'
+        axis_values, self.axis_scaling[axis_i] = self._storedAxis(
+            axis_values, scale, offset)
         self.axes[axis_i] = axis_values
+        self._uniform[axis_i] = (self.uniform and uniformSpacing(axis_values)
+                                 or None)
+        if self._hunt[axis_i] is not None:
+            self._hunt[axis_i] = 0
+        self._cache.clear()
 
-    def setValueTable(self, value_table):
+    def setValueTable(self, value_table, scale=None, offset=None):
         """Set the value table to the specified sequence of sequences.
 
         Nesting should correspond to value_table[axis0_i][axis1_i]...[axisn_i]
 
+        With array storage the axes must be defined first.  The values are
+        copied into an array of the table dtype shaped by the axes, so a
+        flat sequence in the same (C) order is accepted as well.
+
+        For the integer dtypes each value is stored as the nearest code,
+        value = code * scale + offset.  By default the scale and offset
+        fit the range of the values to the full range of the codes.
+        Values out of range of the codes raise an Error.  value_table then
+        holds the codes.
+
+        """
+        self._checkMutable()
+        if self.output_tables:
+            raise Error("Table has named outputs; use addOutput")
+        self.value_table, scaling = self._storedTable(value_table, scale,
+                                                      offset)
+        self.value_scaling = [scaling]
+        self._cache.clear()
+
+    def addOutput(self, name, value_table, scale=None, offset=None):
+        """Add a named output (dependent variable) on the same axes.
+
+        The value table (and scaling) is given as for setValueTable.  Once
+        a table has named outputs, lookups return a tuple with a value for
+        each output, in the order they were added.  The interval search and
+        the interpolation weights are shared by all the outputs.
+
+        """
+        self._checkMutable()
+        if self.output_names.has_key(name):
+            raise Error("Output already exists with name: '%s'" % name)
+        if len(self.value_table) and not self.output_tables:
+            raise Error("Table already has an unnamed value table")
+        value_table, scaling = self._storedTable(value_table, scale, offset)
+        if not self.output_tables:
+            self.value_scaling = []
+        self.output_names[name] = len(self.output_tables)
+        self.output_tables.append(value_table)
+        self.value_scaling.append(scaling)
+        self.value_table = self.output_tables[0]
+        self._cache.clear()
+
+    def getOutputName(self, output_i):
+        """Return the name of the specified output. (Index starts at 0)"""
+
+        result = None
+        for name, i in self.output_names.items():
+            if i == output_i:
+                result = name
+                break
+        return result
+
+    def _storedTable(self, value_table, scale=None, offset=None):
+        """Return (value_table, scaling) converted for the table storage."""
+        scaling = None
+        if self.storage == 'array':
+            shape = tuple([len(axis) for axis in self.axes])
+            value_table = numpy.array(value_table, dtype=numpy.float64)
+            if value_table.size != numpy.prod(shape, dtype=int):
+                raise Error("Value table size %d does not match axes %s"
+                            % (value_table.size, shape))
+            value_table, scaling = quantizeValues(value_table.reshape(shape),
+                                                  self.dtype, scale, offset)
+            value_table = numpy.ascontiguousarray(value_table)
+        elif scale is not None or offset is not None:
+            raise Error("Scale and offset need an integer dtype")
+        return value_table, scaling
+
+    def _storedAxis(self, axis_values, scale=None, offset=None):
+        """Return (axis_values, scaling) rounded to the axis dtype.
+
+        The breakpoints are kept as a list of floats, the values the codes
+        stand for (in the compute dtype).
+
+        """
+        if self.axis_dtype == 'float64' or axis_values is None:
+            if scale is not None or offset is not None:
+                raise Error("Scale and offset need an integer dtype")
+            return axis_values, None
+        codes, scaling = quantizeValues(
+            numpy.asarray(axis_values, dtype=numpy.float64), self.axis_dtype,
+            scale, offset)
+        if scaling is not None:
+            codes = ScaledArray(codes, scaling, numpy.float64)
+        return (numpy.asarray(codes, dtype=self.compute_dtype).tolist(),
+                scaling)
+
+    def _valueTables(self):
+        """Return the list of value tables, one per output."""
+        return self.output_tables or [self.value_table]
+
+    def setHunt(self, axis_name, hunt=True):
+        """Turn hunt mode on (or off) for the specified axis.
+
+        In hunt mode the interval found by the previous lookup is checked
+        first, then its neighbour, before falling back to a binary search.
+        This makes the search O(1) for slowly varying inputs, as in a
+        transient simulation.  The results are the same as without it.
+
+        """
+        self._checkMutable()
+        axis_i = self.axis_names[axis_name]
+        if hunt:
+            if self._hunt[axis_i] is None:
+                self._hunt[axis_i] = 0
+        else:
+            self._hunt[axis_i] = None
+
+    def setInterpMethod(self, axis_name, method):
+        """Set the interpolation method along the specified axis.
+
+        method -- 'linear' (the default), or one of the piecewise cubic
+                  (Hermite) methods:
+                  'pchip' - monotone cubic (Fritsch-Carlson), no overshoot
+                  'akima' - Akima's slopes, little wiggle near outliers
+                  'spline' - natural cubic spline (C2 continuous)
+
+        The slopes at the breakpoints are computed once, with numpy, when
+        first needed after the axes or values are set, so a lookup stays
+        O(1) per axis after the interval search.  With k cubic axes 2^k
+        tables (the values and their cross derivatives) are kept.  Outside
+        the axis range the end slopes are used to extrapolate linearly.
+        The corner kernel setting does not apply to tables with cubic axes.
+
+        This requires numpy.
+
+        """
+        self._checkMutable()
+        if method not in INTERP_METHODS:
+            raise Error("Unknown interpolation method: '%s'" % method)
+        if method != 'linear' and numpy is None:
+            raise Error("Cubic interpolation requires numpy")
+        axis_i = self.axis_names[axis_name]
+        self.interp_methods[axis_i] = method
+        if method == 'linear':
+            self._cubic_mask &= ~(1 << axis_i)
+        else:
+            self._cubic_mask |= 1 << axis_i
+        self._cache.clear()
+
+    def setExtrapolation(self, axis_name, policy):
+        """Set what lookups do beyond the ends of the specified axis.
+
+        policy -- 'linear' to extrapolate from the end interval (the
+                  default), 'clamp' to hold the value at the end breakpoint,
+                  'raise' to raise an Error, or 'nan' to return NaN
+
+        The policy is applied by lookup(), lookup_many() and compiled
+        lookups alike, only for values beyond the ends, so lookups within
+        the axis range cost the same whatever the policy.  With 'clamp' the
+        partial derivative along the axis is zero beyond the ends.
+
+        Out of range values are counted (whatever the policy), see
+        getOutOfRangeCounts.
+
+        """
+        self._checkMutable()
+        if policy not in EXTRAPOLATION_POLICIES:
+            raise Error("Unknown extrapolation policy: '%s'" % policy)
+        self.extrapolation[self.axis_names[axis_name]] = policy
+        self._cache.pop('memo', None)
+
+    def getOutOfRangeCounts(self):
+        """Return {axis_name: (below, above)} counts of out of range values.
+
+        These count the axis values below the first and above the last
+        breakpoint of each axis, over all lookups (including compiled and
+        batched ones) since the table was created or the counts were reset.
+
         """
-        self.value_table = value_table
+        counts = {}
+        for axis_name, axis_i in self.axis_names.items():
+            counts[axis_name] = tuple(self._out_of_range[axis_i])
+        return counts
+
+    def resetOutOfRangeCounts(self):
+        """Set the out of range counts of all the axes to zero."""
+        for counts in self._out_of_range:
+            counts[0] = counts[1] = 0
+
+    def freeze(self):
+        """Make the table immutable, so threads can share it without locks.
+
+        The axes and value tables become tuples (list storage) or
+        read-only arrays, and the data derived from them for lookups are
+        built now rather than on first use, so lookups no longer change
+        the table (apart from the out of range counts, which may miss
+        values counted by concurrent threads).  Setting axes, values,
+        outputs, methods, policies, hunt mode or the memo then raises an
+        Error.  Compiled functions each keep their own hunt state, so give
+        each thread its own for hunt mode.
+
+        A table with a memo or with axes in hunt mode cannot be frozen, as
+        those change on every lookup.  Neither can an invalid table.
+
+        numpy releases the GIL in the array operations of lookup_many, so
+        threads doing large batches run in parallel.
+
+        """
+        if self.frozen:
+            return
+        if self._memo is not None:
+            raise Error("Cannot freeze a table with a memo")
+        for axis_i in range(len(self.axes)):
+            if self._hunt[axis_i] is not None:
+                raise Error("Cannot freeze axis '%s' in hunt mode"
+                            % self.getAxisName(axis_i))
+        if not len(self.value_table) or not self.validate():
+            raise Error("Cannot freeze an invalid table")
+
+        self.axes = [tuple(axis) for axis in self.axes]
+        value_tables = [frozenTable(value_table)
+                        for value_table in self._valueTables()]
+        if self.output_tables:
+            self.output_tables = value_tables
+        self.value_table = value_tables[0]
+
+        # Build the derived data now, with the table valid.
+        self._cache.clear()
+        self._cache['valid'] = True
+        if numpy is not None:
+            axes, value_tables = self._arrays()
+            for array in axes + value_tables:
+                frozenTable(array)
+        if self.storage == 'array':
+            for flat in self._flat()[0]:
+                frozenTable(flat)
+        if self._cubic_mask:
+            for table_flats in self._hermite()[0]:
+                for flat in table_flats.values():
+                    frozenTable(flat)
+        self.frozen = True
+
+    def _checkMutable(self):
+        """Raise an Error if the table is frozen."""
+        if self.frozen:
+            raise Error("Table is frozen")
 
     def getAxisName(self, axis_i):
         """Return the name of the specified axis. (Index starts at 0)"""
@@ -342,7 +1245,24 @@ class LookupTable:
 
         Return True if valid, False if not.
 
+        The result is cached until an axis or value table is set again
+        (changing the axis or value sequences in place is not noticed).
+        Tables with array storage are checked with numpy.
+
         """
+        try:
+            return self._cache['valid']
+        except KeyError:
+            pass
+        if self.storage == 'array':
+            valid = self._validateArrays()
+        else:
+            valid = self._validateSequences()
+        self._cache['valid'] = valid
+        return valid
+
+    def _validateSequences(self):
+        """validate() for tables stored as (nested) sequences."""
         valid = True
 
         # Check that axis values are purely increasing or purely decreasing.
@@ -359,25 +1279,172 @@ class LookupTable:
         # Check that value_table size matches the axis definitions.
         axis_size = tuple([len(axis) for axis in self.axes])
 
-        # todo: Handle possible exception.
-        table_size = nestedSequenceSize(self.value_table)
+        for value_table in self._valueTables():
+            # todo: Handle possible exception.
+            table_size = nestedSequenceSize(value_table)
         
-        if table_size != axis_size:
-            # todo: Error message.
-            valid = False
+            if table_size != axis_size:
+                # todo: Error message.
+                valid = False
 
         return valid
 
+    def _validateArrays(self):
+        """validate() for tables with array storage."""
+        for axis in self.axes:
+            delta_signs = numpy.sign(numpy.diff(numpy.asarray(
+                axis, dtype=numpy.float64)))
+            if not (delta_signs > 0).all() and not (delta_signs < 0).all():
+                return False
+
+        axis_size = tuple([len(axis) for axis in self.axes])
+        for value_table in self._valueTables():
+            if numpy.shape(value_table) != axis_size:
+                return False
+
+        return True
+
     def lookup(self, **kwargs):
         """Lookup the interpolated value for given axis values.
 
         Arguments:
         Specify the axis values for the lookup, using the axis names as
         keyword arguments.
+
+        For a table with named outputs a tuple of the output values is
+        returned.
         
+        """
+        if self._memo is not None:
+            return self._memoLookup(kwargs)
+        return self._lookup(kwargs)
+
+    def _lookup(self, kwargs):
+        """lookup() without the memo."""
+        if self.compute_dtype != 'float64':
+            # Single precision arithmetic is done by the array kernels (on
+            # one element arrays, as numpy scalars would promote to float64).
+            results = self.lookup_many(**self._pointArrays(kwargs))
+            if self.output_tables:
+                return tuple([float(result[0]) for result in results])
+            return float(results[0])
+
+        axis_values, nearest_indexes = self._intervals(kwargs)
+
+        # Need to interpolate on this data.
+        if self._cubic_mask:
+            return self.interp_hermite(axis_values, nearest_indexes)
+        if self.output_tables:
+            return self.interp_outputs(axis_values, nearest_indexes)
+        if self.kernel == 'corner':
+            return self.interp_corners(axis_values, nearest_indexes)
+        if self.storage == 'array':
+            return self.interp_strided(axis_values, nearest_indexes)
+        return self.interp_n(axis_values, nearest_indexes, self.value_table)
+
+    def _pointArrays(self, kwargs):
+        """Return the lookup arguments as one element lists."""
+        point = {}
+        for axis_name, axis_value in kwargs.items():
+            point[axis_name] = [axis_value]
+        return point
+
+    def setMemo(self, capacity=1024, resolution=None):
+        """Keep the results of recent lookup() calls for reuse.
+
+        capacity -- number of results kept; the least recently used one is
+                    dropped to make room (None or 0 turns the memo off)
+        resolution -- quantum of the axis values in the memo key, either
+                      one number for all the axes or {axis_name: quantum}
+                      (None, the default, for exact axis values).  Lookups
+                      whose axis values round to the same multiples share
+                      the result of the first of them.
+
+        The memo is cleared when the axes, values, methods or policies are
+        set, and is only used by lookup().  Repeated lookups then skip the
+        interval search and the interpolation, but hunt mode and the out of
+        range counts only see the lookups not found in the memo.  See
+        getMemoStats for the hit rate.
+
+        """
+        self._checkMutable()
+        if capacity and OrderedDict is None:
+            raise Error("The lookup memo requires collections.OrderedDict")
+        if capacity:
+            self._memo = (capacity, resolution)
+        else:
+            self._memo = None
+        self._cache.pop('memo', None)
+
+    def getMemoStats(self):
+        """Return {'hits', 'misses', 'evictions', 'size', 'capacity'} counts.
+
+        hits and misses count the lookups found and not found in the memo,
+        and evictions the results dropped to make room, since setMemo or
+        resetMemoStats.
+
+        """
+        hits, misses, evictions = self._memo_stats
+        size = 0
+        capacity = 0
+        if self._memo is not None:
+            capacity = self._memo[0]
+            if 'memo' in self._cache:
+                size = len(self._cache['memo'][0])
+        return {'hits': hits, 'misses': misses, 'evictions': evictions,
+                'size': size, 'capacity': capacity}
+
+    def resetMemoStats(self):
+        """Set the memo hit, miss and eviction counts to zero."""
+        self._memo_stats[:] = [0, 0, 0]
+
+    def _memoLookup(self, kwargs):
+        """lookup() through the memo (see setMemo)."""
+        try:
+            entries, quanta = self._cache['memo']
+        except KeyError:
+            capacity, resolution = self._memo
+            quanta = []
+            for axis_i in range(len(self.axes)):
+                axis_name = self.getAxisName(axis_i)
+                if hasattr(resolution, 'get'):
+                    quanta.append((axis_name, resolution.get(axis_name)))
+                else:
+                    quanta.append((axis_name, resolution))
+            entries = OrderedDict()
+            self._cache['memo'] = (entries, quanta)
+
+        key = []
+        for axis_name, quantum in quanta:
+            axis_value = kwargs.get(axis_name)
+            if quantum and axis_value is not None:
+                axis_value = round(axis_value / quantum)
+            key.append(axis_value)
+        key = tuple(key)
+
+        stats = self._memo_stats
+        try:
+            # Move the entry to the most recently used end.
+            result = entries.pop(key)
+        except KeyError:
+            stats[1] += 1
+            result = self._lookup(kwargs)
+            if len(entries) >= self._memo[0]:
+                entries.popitem(last=False)
+                stats[2] += 1
+        else:
+            stats[0] += 1
+        entries[key] = result
+        return result
+
+    def _intervals(self, kwargs):
+        """Return (axis_values, nearest_indexes) for the lookup arguments.
+
+        kwargs -- axis values by axis name, as given to lookup()
+
         """
         # Check that a value table exists.
-        if not self.value_table:
+        if not len(self.value_table):
             raise Error("No values set for lookup table")
 
         # Check that axis values have been specified.
@@ -405,21 +1472,189 @@ class LookupTable:
 
             axis_values[axis_i] = axis_value
 
-            interval_start_i = bisect_right(axis, axis_value) - 1
+            hunt_i = self._hunt[axis_i]
+            if hunt_i is not None:
+                interval_start_i = huntInterval(axis, axis_value, hunt_i)
+                self._hunt[axis_i] = interval_start_i
+            else:
+                interval_start_i = bisect_right(axis, axis_value) - 1
             # Ensure there is always one point after the interval start point.
-            if interval_start_i > (len(axis) - 2):
+            # Values beyond the end breakpoints are counted, and handled by
+            # the extrapolation policy of the axis.
+            if interval_start_i >= len(axis) - 2:
                 interval_start_i = len(axis) - 2
-            elif interval_start_i < 0:
+                if axis_value > axis[-1]:
+                    axis_values[axis_i] = self._outOfRange(axis_i, 1,
+                                                           axis_value)
+            if interval_start_i <= 0:
                 interval_start_i = 0
+                if axis_value < axis[0]:
+                    axis_values[axis_i] = self._outOfRange(axis_i, 0,
+                                                           axis_value)
 
             nearest_indexes[axis_i] = interval_start_i
 
 ##         print 'axis_values', axis_values
 ##         print 'nearest_indexes', nearest_indexes
 ##         print 'value_table', self.value_table
-        
-        # Need to interpolate on this data.
-        return self.interp_n(axis_values, nearest_indexes, self.value_table)
+
+        return axis_values, nearest_indexes
+
+    def _outOfRange(self, axis_i, side, axis_value):
+        """Count an axis value beyond the axis, and apply the policy.
+
+        side -- 0 below the first breakpoint, 1 above the last one
+
+        Returns the axis value to interpolate at (see setExtrapolation).
+
+        """
+        self._out_of_range[axis_i][side] += 1
+        policy = self.extrapolation[axis_i]
+        if policy == 'clamp':
+            if side:
+                return self.axes[axis_i][-1]
+            return self.axes[axis_i][0]
+        if policy == 'nan':
+            return NAN
+        if policy == 'raise':
+            raise Error("Value %r out of range for axis '%s'"
+                        % (axis_value, self.getAxisName(axis_i)))
+        return axis_value
+
+    def lookup_with_gradient(self, **kwargs):
+        """Lookup the interpolated value and its gradient.
+
+        Arguments are as for lookup().  Returns (value, partials), where
+        partials is a list of the partial derivatives of the interpolated
+        value with respect to each axis, in axis order.  They come from the
+        same cell and interpolation weights as the value, in one pass,
+        instead of 2N + 1 lookups for central differences.  (At a breakpoint
+        the derivative of the interval above is given, as it is the one used
+        for the value.)
+
+        The value is the same as from lookup() with the recursive kernel.
+        For a table with named outputs a tuple of values and a tuple of
+        partials lists are returned.
+
+        """
+        if self.compute_dtype != 'float64':
+            # Single precision arithmetic is done by the array kernels.
+            values, partials = self.lookup_many_with_gradient(
+                **self._pointArrays(kwargs))
+            if self.output_tables:
+                return (tuple([float(value[0]) for value in values]),
+                        tuple([[float(partial[0]) for partial in output]
+                               for output in partials]))
+            return (float(values[0]),
+                    [float(partial[0]) for partial in partials])
+
+        axis_values, nearest_indexes = self._intervals(kwargs)
+        results = self.interp_gradient(axis_values, nearest_indexes)
+        # Beyond the ends of clamped axes the value does not change.
+        for axis_name, axis_i in self.axis_names.items():
+            if self.extrapolation[axis_i] == 'clamp':
+                axis = self.axes[axis_i]
+                axis_value = kwargs[axis_name]
+                if axis_value < axis[0] or axis_value > axis[-1]:
+                    for value, partials in results:
+                        partials[axis_i] = 0.0
+        if self.output_tables:
+            return (tuple([value for value, partials in results]),
+                    tuple([partials for value, partials in results]))
+        return results[0]
+
+    def interp_gradient(self, axis_values, nearest_indexes):
+        """Interpolate across multiple dimensions, with the gradient.
+
+        The 2^N corner values are reduced one axis at a time, starting with
+        the last, as in interp_strided (or interp_hermite, for tables with
+        cubic axes).  Each partially reduced value carries its partial
+        derivatives along the axes already reduced: the derivative along
+        the axis being reduced comes from the slope between the corners,
+        and the inner derivatives are interpolated like the values.
+
+        Returns a list of (value, partials) for each output.
+
+        axis_values -- tuple of axis coords for which to find the value
+                       (x, y, ...)
+        nearest_indexes -- [x1_i, x2_i, ...]
+                           table indexes for nearest (on the left if
+                           possible) table value
+
+        """
+        # (x - x1) and (x2 - x1), or the Hermite weights of the value and
+        # of its derivative, for each axis
+        axis_weights = []
+        for axis_i in range(len(self.axes)):
+            axis = self.axes[axis_i]
+            x1_i = nearest_indexes[axis_i]
+            x1 = axis[x1_i]
+            offset = axis_values[axis_i] - x1
+            span = axis[x1_i + 1] - x1
+            if self._cubic_mask & (1 << axis_i):
+                axis_weights.append((hermiteWeights(offset, span),
+                                     hermiteSlopeWeights(offset, span)))
+            else:
+                axis_weights.append((offset, span))
+
+        if self._cubic_mask:
+            flats, strides, corner_offsets = self._hermite()
+            offset = 0
+            for x1_i, stride in zip(nearest_indexes, strides):
+                offset += x1_i * stride
+            corner_indexes = corner_offsets + offset
+            table_corners = []
+            for table_flats in flats:
+                corners = {}
+                for mask, flat in table_flats.items():
+                    corners[mask] = flat.take(corner_indexes).tolist()
+                table_corners.append(corners)
+        else:
+            table_corners = [{0: self._cornerValues(nearest_indexes, table_i)}
+                             for table_i in range(len(self._valueTables()))]
+
+        results = []
+        for corners in table_corners:
+            # (value, [partials along the axes reduced so far]) per corner
+            values = {}
+            for mask, ys in corners.items():
+                values[mask] = [(y, []) for y in ys]
+            for axis_i in range(len(self.axes) - 1, -1, -1):
+                bit = 1 << axis_i
+                if not self._cubic_mask & bit:
+                    offset, span = axis_weights[axis_i]
+                    for mask, entries in values.items():
+                        reduced = []
+                        for (y1, g1), (y2, g2) in zip(entries[0::2],
+                                                      entries[1::2]):
+                            partials = [(y2 - y1) / span]
+                            for p1, p2 in zip(g1, g2):
+                                partials.append((p2 - p1) / span * offset + p1)
+                            reduced.append(((y2 - y1) / span * offset + y1,
+                                            partials))
+                        values[mask] = reduced
+                    continue
+                ((wy1, wd1, wy2, wd2),
+                 (sy1, sd1, sy2, sd2)) = axis_weights[axis_i]
+                reduced_values = {}
+                for mask, entries in values.items():
+                    if mask & bit:
+                        continue
+                    d_entries = values[mask | bit]
+                    reduced = []
+                    for (y1, g1), (y2, g2), (d1, h1), (d2, h2) in zip(
+                            entries[0::2], entries[1::2],
+                            d_entries[0::2], d_entries[1::2]):
+                        partials = [sy1 * y1 + sd1 * d1 + sy2 * y2 + sd2 * d2]
+                        for p1, p2, q1, q2 in zip(g1, g2, h1, h2):
+                            partials.append(wy1 * p1 + wd1 * q1 + wy2 * p2
+                                            + wd2 * q2)
+                        reduced.append((wy1 * y1 + wd1 * d1 + wy2 * y2
+                                        + wd2 * d2, partials))
+                    reduced_values[mask] = reduced
+                values = reduced_values
+            results.append(values[0][0])
+        return results
             
     def interp_n(self, axis_values, nearest_indexes, value_table):
         """Linearly interpolate across multiple dimensions.
@@ -459,9 +1694,1544 @@ class LookupTable:
 
         return val
 
+    def interp_strided(self, axis_values, nearest_indexes):
+        """Linearly interpolate across multiple dimensions (array storage).
+
+        The 2^N corner values around the point are taken from the flat value
+        array in one go, at the offset given by the array strides, and then
+        reduced one axis at a time, starting with the last axis.
+
+        This does the same arithmetic as interp_n, so the results match.
+
+        axis_values -- tuple of axis coords for which to find the value
+                       (x, y, ...)
+        nearest_indexes -- [x1_i, x2_i, ...]
+                           table indexes for nearest (on the left if
+                           possible) table value
+
+        """
+        values = self._cornerValues(nearest_indexes)
+
+        for axis_i in range(len(self.axes) - 1, -1, -1):
+            axis = self.axes[axis_i]
+            x1_i = nearest_indexes[axis_i]
+            x = axis_values[axis_i]
+            x1 = axis[x1_i]
+            x2 = axis[x1_i + 1]
+            # Corners differing only along this axis are adjacent.
+            values = [(y2 - y1) / (x2 - x1) * (x - x1) + y1
+                      for y1, y2 in zip(values[0::2], values[1::2])]
+
+        return values[0]
+
+    def interp_corners(self, axis_values, nearest_indexes):
+        """Multilinearly interpolate as one weighted sum of the cell corners.
+
+        The weight of each of the 2^N corners is the product of the
+        fractional distances along each axis, so no intermediate lists of
+        partially interpolated values are built.  The result agrees with
+        interp_n to within rounding.
+
+        axis_values -- tuple of axis coords for which to find the value
+                       (x, y, ...)
+        nearest_indexes -- [x1_i, x2_i, ...]
+                           table indexes for nearest (on the left if
+                           possible) table value
+
+        """
+        val = 0.0
+        for weight, value in zip(self._cornerWeights(axis_values,
+                                                     nearest_indexes),
+                                 self._cornerValues(nearest_indexes)):
+            val += weight * value
+
+        return val
+
+    def interp_outputs(self, axis_values, nearest_indexes):
+        """Interpolate every named output, returning a tuple of values.
+
+        The offsets within the interval along each axis (or the corner
+        weights, with the corner kernel) are computed once and used for all
+        the outputs.  Each output gets the same result as a table of its own.
+
+        axis_values -- tuple of axis coords for which to find the value
+                       (x, y, ...)
+        nearest_indexes -- [x1_i, x2_i, ...]
+                           table indexes for nearest (on the left if
+                           possible) table value
+
+        """
+        results = []
+        if self.kernel == 'corner':
+            weights = self._cornerWeights(axis_values, nearest_indexes)
+            for table_i in range(len(self.output_tables)):
+                val = 0.0
+                for weight, value in zip(
+                        weights, self._cornerValues(nearest_indexes, table_i)):
+                    val += weight * value
+                results.append(val)
+            return tuple(results)
+
+        # (x - x1) and (x2 - x1) for each axis
+        offsets = []
+        spans = []
+        for axis_i in range(len(self.axes)):
+            axis = self.axes[axis_i]
+            x1_i = nearest_indexes[axis_i]
+            x1 = axis[x1_i]
+            offsets.append(axis_values[axis_i] - x1)
+            spans.append(axis[x1_i + 1] - x1)
+
+        for table_i in range(len(self.output_tables)):
+            values = self._cornerValues(nearest_indexes, table_i)
+            for axis_i in range(len(self.axes) - 1, -1, -1):
+                span = spans[axis_i]
+                offset = offsets[axis_i]
+                values = [(y2 - y1) / span * offset + y1
+                          for y1, y2 in zip(values[0::2], values[1::2])]
+            results.append(values[0])
+        return tuple(results)
+
+    def _cornerWeights(self, axis_values, nearest_indexes):
+        """Return the multilinear weights of the 2^N cell corners."""
+        weights = [1.0]
+        for axis_i in range(len(self.axes)):
+            axis = self.axes[axis_i]
+            x1_i = nearest_indexes[axis_i]
+            x1 = axis[x1_i]
+            frac = (axis_values[axis_i] - x1) / (axis[x1_i + 1] - x1)
+            weights = [weight * axis_weight for weight in weights
+                       for axis_weight in (1.0 - frac, frac)]
+        return weights
+
+    def _cornerValues(self, nearest_indexes, table_i=0):
+        """Return the 2^N values at the corners of the interpolation cell.
+
+        The first axis is the most significant, so corners differing only
+        along the last axis are adjacent.
+
+        table_i -- output index, for tables with named outputs
+
+        """
+        if self.storage == 'array':
+            flats, strides, corner_offsets = self._flat()
+            offset = 0
+            for x1_i, stride in zip(nearest_indexes, strides):
+                offset += x1_i * stride
+            values = flats[table_i].take(corner_offsets + offset).tolist()
+            scaling = self.value_scaling[table_i]
+            if scaling is not None:
+                scale, scale_offset = scaling
+                values = [code * scale + scale_offset for code in values]
+            return values
+
+        values = [self._valueTables()[table_i]]
+        for x1_i in nearest_indexes:
+            values = [sub_table[i] for sub_table in values
+                      for i in (x1_i, x1_i + 1)]
+        return values
+
+    def _flat(self):
+        """Return (flat_tables, strides, corner_offsets) for array storage.
+
+        flat_tables -- flat views of the value tables, one per output
+
+        strides -- element (not byte) strides of the value array
+        corner_offsets -- offsets of the 2^N cell corners from the lower
+                          corner, ordered with the first axis most significant
+
+        """
+        try:
+            return self._cache['flat']
+        except KeyError:
+            value_table = self.value_table
+            strides = [stride // value_table.itemsize
+                       for stride in value_table.strides]
+            corner_offsets = [0]
+            for stride in strides:
+                corner_offsets = [offset + bit * stride
+                                  for offset in corner_offsets
+                                  for bit in (0, 1)]
+            flat = ([table.ravel() for table in self._valueTables()], strides,
+                    numpy.array(corner_offsets, dtype=numpy.intp))
+            self._cache['flat'] = flat
+            return flat
+
+    def interp_hermite(self, axis_values, nearest_indexes):
+        """Interpolate with cubic Hermite polynomials along the cubic axes.
+
+        The 2^N corner values are taken from the value table and from each
+        precomputed derivative table (see _hermite), then reduced one axis
+        at a time, starting with the last.  Linear axes are reduced as in
+        interp_strided.  A cubic axis combines each table with its
+        derivative along that axis, using the Hermite weights of the
+        point (see hermiteWeights).
+
+        Returns a tuple of values for a table with named outputs.
+
+        axis_values -- tuple of axis coords for which to find the value
+                       (x, y, ...)
+        nearest_indexes -- [x1_i, x2_i, ...]
+                           table indexes for nearest (on the left if
+                           possible) table value
+
+        """
+        flats, strides, corner_offsets = self._hermite()
+        offset = 0
+        for x1_i, stride in zip(nearest_indexes, strides):
+            offset += x1_i * stride
+        corner_indexes = corner_offsets + offset
+
+        # (x - x1) and (x2 - x1), or the Hermite weights, for each axis
+        axis_weights = []
+        for axis_i in range(len(self.axes)):
+            axis = self.axes[axis_i]
+            x1_i = nearest_indexes[axis_i]
+            x1 = axis[x1_i]
+            offset = axis_values[axis_i] - x1
+            span = axis[x1_i + 1] - x1
+            if self._cubic_mask & (1 << axis_i):
+                axis_weights.append(hermiteWeights(offset, span))
+            else:
+                axis_weights.append((offset, span))
+
+        results = []
+        for table_flats in flats:
+            values = {}
+            for mask, flat in table_flats.items():
+                values[mask] = flat.take(corner_indexes).tolist()
+            for axis_i in range(len(self.axes) - 1, -1, -1):
+                bit = 1 << axis_i
+                if not self._cubic_mask & bit:
+                    offset, span = axis_weights[axis_i]
+                    for mask, ys in values.items():
+                        values[mask] = [(y2 - y1) / span * offset + y1
+                                        for y1, y2 in zip(ys[0::2], ys[1::2])]
+                    continue
+                wy1, wd1, wy2, wd2 = axis_weights[axis_i]
+                reduced = {}
+                for mask, ys in values.items():
+                    if mask & bit:
+                        continue
+                    ds = values[mask | bit]
+                    reduced[mask] = [wy1 * y1 + wd1 * d1 + wy2 * y2 + wd2 * d2
+                                     for y1, y2, d1, d2
+                                     in zip(ys[0::2], ys[1::2],
+                                            ds[0::2], ds[1::2])]
+                values = reduced
+            results.append(values[0][0])
+
+        if self.output_tables:
+            return tuple(results)
+        return results[0]
+
+    def _hermite(self):
+        """Return (tables, strides, corner_offsets) for cubic interpolation.
+
+        tables -- for each output, a dict mapping a mask of cubic axis bits
+                  (1 << axis_i) to a flat array of the values
+                  differentiated along those axes (mask 0 is the values
+                  themselves)
+        strides -- element strides of the (C-order) value arrays
+        corner_offsets -- offsets of the 2^N cell corners from the lower
+                          corner, ordered with the first axis most significant
+
+        The slopes along each cubic axis are estimated from the values at
+        the breakpoints by its method (see axisSlopes).  These are cached
+        until the axes, values or methods are set again.
+
+        """
+        try:
+            return self._cache['hermite']
+        except KeyError:
+            axes, value_tables = self._arrays()
+            tables = []
+            for value_table in value_tables:
+                derivatives = {0: value_table}
+                for axis_i in range(len(axes)):
+                    bit = 1 << axis_i
+                    if not self._cubic_mask & bit:
+                        continue
+                    for mask, derivative in derivatives.items():
+                        derivatives[mask | bit] = axisSlopes(
+                            derivative, axes[axis_i], axis_i,
+                            self.interp_methods[axis_i])
+                flats = {}
+                for mask, derivative in derivatives.items():
+                    flats[mask] = numpy.ascontiguousarray(
+                        derivative, dtype=self.compute_dtype).ravel()
+                tables.append(flats)
+
+            strides = []
+            stride = 1
+            for axis in reversed(axes):
+                strides.insert(0, stride)
+                stride *= len(axis)
+            corner_offsets = [0]
+            for stride in strides:
+                corner_offsets = [offset + bit * stride
+                                  for offset in corner_offsets
+                                  for bit in (0, 1)]
+            hermite = (tables, strides,
+                       numpy.array(corner_offsets, dtype=numpy.intp))
+            self._cache['hermite'] = hermite
+            return hermite
+
+    def lookup_many(self, **kwargs):
+        """Lookup the interpolated values for arrays of axis values.
+
+        Arguments:
+        Specify sequences (or numpy arrays) of axis values, using the axis
+        names as keyword arguments.  They are broadcast against each other,
+        and a numpy array of the broadcast shape is returned (a tuple of them
+        for a table with named outputs).
+
+        The interpolation is done with the same arithmetic as lookup(),
+        (including the linear extrapolation) so the results are identical
+        to calling lookup() once per point.
+
+        This requires numpy.
+
+        """
+        if numpy is None:
+            raise Error("lookup_many requires numpy")
+        nearest_indexes, offsets, spans, clamped = self._intervals_many(kwargs)
+
+        if self._cubic_mask:
+            weights = [None] * len(self.axes)
+            for axis_i in range(len(self.axes)):
+                if self._cubic_mask & (1 << axis_i):
+                    weights[axis_i] = hermiteWeightsMany(offsets[axis_i],
+                                                         spans[axis_i])
+            results = [self._hermite_many(offsets, spans, weights,
+                                          nearest_indexes, derivatives, (), 0)
+                       for derivatives in self._derivativeTables()]
+        else:
+            results = [self._interp_many(offsets, spans, nearest_indexes,
+                                         value_table, ())
+                       for value_table in self._arrays()[1]]
+        if self.output_tables:
+            return tuple(results)
+        return results[0]
+
+    def _intervals_many(self, kwargs):
+        """Return (nearest_indexes, offsets, spans, clamped) for lookup_many.
+
+        kwargs -- axis value arrays by axis name, as given to lookup_many()
+
+        offsets, spans -- (x - x1) and (x2 - x1) arrays for each axis, shared
+                          by all the outputs
+        clamped -- {axis_i: mask of the values held at the axis ends} for
+                   the axes with the 'clamp' policy
+
+        """
+        # Check that a value table exists.
+        if not len(self.value_table):
+            raise Error("No values set for lookup table")
+
+        # Check that axis values have been specified.
+        for axis_name in self.axis_names.keys():
+            if kwargs.get(axis_name) is None:
+                raise Error("No axis value for '%s'" % axis_name)
+
+        axis_values = [None] * len(self.axes)
+        for axis_name, axis_i in self.axis_names.items():
+            axis_values[axis_i] = numpy.asarray(kwargs[axis_name],
+                                                dtype=self.compute_dtype)
+        axis_values = numpy.broadcast_arrays(*axis_values)
+
+        axes = self._arrays()[0]
+
+        # Count the values beyond the ends, and apply the policies.
+        clamped = {}
+        nan_axes = {}
+        for axis_i in range(len(axes)):
+            axis = axes[axis_i]
+            axis_value = axis_values[axis_i]
+            with numpy.errstate(invalid='ignore'):
+                below = axis_value < axis[0]
+                above = axis_value > axis[-1]
+            n_below = numpy.count_nonzero(below)
+            n_above = numpy.count_nonzero(above)
+            if not (n_below or n_above):
+                continue
+            self._out_of_range[axis_i][0] += n_below
+            self._out_of_range[axis_i][1] += n_above
+            policy = self.extrapolation[axis_i]
+            if policy == 'clamp':
+                clamped[axis_i] = below | above
+                axis_values[axis_i] = numpy.clip(axis_value, axis[0],
+                                                 axis[-1])
+            elif policy == 'nan':
+                nan_axes[axis_i] = below | above
+            elif policy == 'raise':
+                raise Error("Value %r out of range for axis '%s'"
+                            % (float(axis_value[below | above].flat[0]),
+                               self.getAxisName(axis_i)))
+
+        nearest_indexes = []
+        for axis, axis_value, uniform in zip(axes, axis_values,
+                                             self._uniform):
+            last_start_i = len(axis) - 2
+            if uniform is None:
+                interval_start_i = numpy.searchsorted(axis, axis_value,
+                                                      side='right') - 1
+            else:
+                start, scale = uniform
+                interval_start_i = numpy.clip(
+                    numpy.nan_to_num((axis_value - start) * scale),
+                    0, last_start_i).astype(numpy.intp)
+                # Move values rounded into the neighbouring interval back.
+                with numpy.errstate(invalid='ignore'):
+                    interval_start_i -= (
+                        (axis_value < axis[interval_start_i])
+                        & (interval_start_i > 0))
+                    interval_start_i += (
+                        (axis_value >= axis[interval_start_i + 1])
+                        & (interval_start_i < last_start_i))
+            # Ensure there is always one point after the interval start point.
+            nearest_indexes.append(numpy.clip(interval_start_i, 0,
+                                              last_start_i))
+
+        # (x - x1) and (x2 - x1) for each axis
+        offsets = []
+        spans = []
+        for axis, axis_value, x1_i in zip(axes, axis_values, nearest_indexes):
+            x1 = axis[x1_i]
+            offsets.append(axis_value - x1)
+            spans.append(axis[x1_i + 1] - x1)
+        for axis_i, out_of_range in nan_axes.items():
+            offsets[axis_i] = numpy.where(out_of_range, NAN, offsets[axis_i])
+
+        return nearest_indexes, offsets, spans, clamped
+
+    def lookup_many_with_gradient(self, **kwargs):
+        """Lookup the interpolated values and gradients for arrays of points.
+
+        Arguments are as for lookup_many().  Returns (values, partials),
+        where partials is a list of arrays of the partial derivatives with
+        respect to each axis, in axis order, all of the broadcast shape.
+        For a table with named outputs a tuple of values arrays and a tuple
+        of partials lists are returned.
+
+        The results are identical to calling lookup_with_gradient() once
+        per point, so a Jacobian over many points takes one call.
+
+        This requires numpy.
+
+        """
+        if numpy is None:
+            raise Error("lookup_many_with_gradient requires numpy")
+        nearest_indexes, offsets, spans, clamped = self._intervals_many(kwargs)
+
+        weights = [None] * len(self.axes)
+        for axis_i in range(len(self.axes)):
+            if self._cubic_mask & (1 << axis_i):
+                weights[axis_i] = (
+                    hermiteWeightsMany(offsets[axis_i], spans[axis_i]),
+                    hermiteSlopeWeightsMany(offsets[axis_i], spans[axis_i]))
+        results = [self._gradient_many(offsets, spans, weights,
+                                       nearest_indexes, derivatives, (), 0)
+                   for derivatives in self._derivativeTables()]
+        # Beyond the ends of clamped axes the value does not change.
+        for axis_i, out_of_range in clamped.items():
+            for values, partials in results:
+                partials[axis_i] = numpy.where(out_of_range, 0.0,
+                                               partials[axis_i])
+        if self.output_tables:
+            return (tuple([values for values, partials in results]),
+                    tuple([partials for values, partials in results]))
+        return results[0]
+
+    def _derivativeTables(self):
+        """Return {mask: array} for each output, as used by _hermite_many.
+
+        For tables without cubic axes this is just {0: value array}.
+
+        """
+        if not self._cubic_mask:
+            return [{0: value_table} for value_table in self._arrays()[1]]
+        tables, strides, corner_offsets = self._hermite()
+        shape = tuple([len(axis) for axis in self.axes])
+        results = []
+        for table_flats in tables:
+            derivatives = {}
+            for mask, flat in table_flats.items():
+                derivatives[mask] = flat.reshape(shape)
+            results.append(derivatives)
+        return results
+
+    def _interp_many(self, offsets, spans, nearest_indexes, value_table,
+                     outer_indexes):
+        """Vectorized equivalent of interp_n.
+
+        offsets, spans -- (x - x1) and (x2 - x1) arrays for each axis
+        outer_indexes -- tuple of index arrays already chosen for the
+                         preceding axes (the recursion replaces the slicing
+                         of nested lists done by interp_n)
+
+        """
+        axis_i = len(outer_indexes)
+        x1_i = nearest_indexes[axis_i]
+        x2_i = x1_i + 1
+
+        if axis_i < len(nearest_indexes) - 1:
+            # The value still depends on other axes.
+            y1 = self._interp_many(offsets, spans, nearest_indexes,
+                                   value_table, outer_indexes + (x1_i,))
+            y2 = self._interp_many(offsets, spans, nearest_indexes,
+                                   value_table, outer_indexes + (x2_i,))
+        else:
+            y1 = value_table[outer_indexes + (x1_i,)]
+            y2 = value_table[outer_indexes + (x2_i,)]
+
+        # Same operation order as interp_n, so the results match exactly.
+        slope = (y2 - y1) / spans[axis_i]
+        val = slope * offsets[axis_i] + y1
+
+        return val
+
+    def _hermite_many(self, offsets, spans, weights, nearest_indexes,
+                      derivatives, outer_indexes, mask):
+        """Vectorized equivalent of interp_hermite.
+
+        offsets, spans -- (x - x1) and (x2 - x1) arrays for each axis
+        weights -- Hermite weight arrays for each cubic axis, None for the
+                   linear axes
+        derivatives -- {mask: value or derivative table} (see _hermite)
+        outer_indexes -- tuple of index arrays already chosen for the
+                         preceding axes
+        mask -- cubic axes among the preceding ones along which the table
+                is differentiated in this branch
+
+        """
+        axis_i = len(outer_indexes)
+        x1_i = nearest_indexes[axis_i]
+        x2_i = x1_i + 1
+
+        def corner(x_i, corner_mask):
+            if axis_i < len(nearest_indexes) - 1:
+                # The value still depends on other axes.
+                return self._hermite_many(offsets, spans, weights,
+                                          nearest_indexes, derivatives,
+                                          outer_indexes + (x_i,), corner_mask)
+            return derivatives[corner_mask][outer_indexes + (x_i,)]
+
+        y1 = corner(x1_i, mask)
+        y2 = corner(x2_i, mask)
+        if weights[axis_i] is None:
+            slope = (y2 - y1) / spans[axis_i]
+            return slope * offsets[axis_i] + y1
+
+        # Same operation order as interp_hermite, so the results match.
+        d1 = corner(x1_i, mask | (1 << axis_i))
+        d2 = corner(x2_i, mask | (1 << axis_i))
+        wy1, wd1, wy2, wd2 = weights[axis_i]
+        return wy1 * y1 + wd1 * d1 + wy2 * y2 + wd2 * d2
+
+    def _gradient_many(self, offsets, spans, weights, nearest_indexes,
+                       derivatives, outer_indexes, mask):
+        """Vectorized equivalent of interp_gradient.
+
+        Returns (values, partials along this and the following axes).
+        Arguments are as for _hermite_many, except that the weights of each
+        cubic axis are a pair: the Hermite weights of the value and of its
+        derivative.
+
+        """
+        axis_i = len(outer_indexes)
+        x1_i = nearest_indexes[axis_i]
+        x2_i = x1_i + 1
+
+        def corner(x_i, corner_mask):
+            if axis_i < len(nearest_indexes) - 1:
+                # The value still depends on other axes.
+                return self._gradient_many(offsets, spans, weights,
+                                           nearest_indexes, derivatives,
+                                           outer_indexes + (x_i,),
+                                           corner_mask)
+            return derivatives[corner_mask][outer_indexes + (x_i,)], []
+
+        y1, g1 = corner(x1_i, mask)
+        y2, g2 = corner(x2_i, mask)
+        if weights[axis_i] is None:
+            span = spans[axis_i]
+            offset = offsets[axis_i]
+            slope = (y2 - y1) / span
+            partials = [slope]
+            for p1, p2 in zip(g1, g2):
+                partials.append((p2 - p1) / span * offset + p1)
+            return slope * offset + y1, partials
+
+        # Same operation order as interp_gradient, so the results match.
+        d1, h1 = corner(x1_i, mask | (1 << axis_i))
+        d2, h2 = corner(x2_i, mask | (1 << axis_i))
+        (wy1, wd1, wy2, wd2), (sy1, sd1, sy2, sd2) = weights[axis_i]
+        partials = [sy1 * y1 + sd1 * d1 + sy2 * y2 + sd2 * d2]
+        for p1, p2, q1, q2 in zip(g1, g2, h1, h2):
+            partials.append(wy1 * p1 + wd1 * q1 + wy2 * p2 + wd2 * q2)
+        return wy1 * y1 + wd1 * d1 + wy2 * y2 + wd2 * d2, partials
+
+    def _arrays(self):
+        """Return (axes, value_tables) as lists of numpy arrays.
+
+        They are of the compute dtype, except that integer value tables
+        are given as ScaledArrays, decoding only the values indexed.
+        These are cached until the axes or value tables are set again.
+
+        """
+        try:
+            return self._cache['arrays']
+        except KeyError:
+            axes = [numpy.asarray(axis, dtype=self.compute_dtype)
+                    for axis in self.axes]
+            value_tables = []
+            for value_table, scaling in zip(self._valueTables(),
+                                            self.value_scaling or [None]):
+                if scaling is None:
+                    value_table = numpy.asarray(value_table,
+                                                dtype=self.compute_dtype)
+                else:
+                    value_table = ScaledArray(value_table, scaling,
+                                              self.compute_dtype)
+                value_tables.append(value_table)
+            self._cache['arrays'] = (axes, value_tables)
+            return axes, value_tables
+
+    def compile(self, *axis_names):
+        """Return a fast lookup function taking positional axis values.
+
+        Arguments:
+        axis_names -- order of the function arguments (default: the order
+                      in which the axes were added)
+
+        The returned function, e.g. f(x, y, z), skips the axis name
+        resolution and argument checks done by lookup().  Its code is
+        generated for this table, with the interval search and the 2^N
+        corner interpolation unrolled for the number of axes.  It does the
+        same arithmetic as lookup() with the recursive kernel (or with the
+        Hermite weights along cubic axes), so the results match.  For a
+        table with named outputs it returns a tuple, like lookup().
+
+        The function works on a snapshot of the axes, values and
+        extrapolation policies, so compile again after changing the table.
+        Axes in hunt mode keep their own previous interval in each compiled
+        function.  Out of range values are added to the counts of the table.
+
+        Tables with float32 arithmetic (see __init__) get a function
+        calling lookup() instead.
+
+        """
+        if not len(self.value_table):
+            raise Error("No values set for lookup table")
+        n_axes = len(self.axes)
+        if not axis_names:
+            axis_names = [self.getAxisName(axis_i)
+                          for axis_i in range(n_axes)]
+        for axis_name in axis_names:
+            if axis_name not in self.axis_names:
+                raise Error("No axis with name: '%s'" % axis_name)
+        if len(dict.fromkeys(axis_names)) != n_axes \
+                or len(axis_names) != n_axes:
+            raise Error("Need each of the %d axis names exactly once"
+                        % n_axes)
+        if self.compute_dtype != 'float64':
+            table_lookup = self.lookup
+
+            def lookup(*args):
+                return table_lookup(**dict(zip(axis_names, args)))
+            return lookup
+
+        namespace = {'bisect_right': bisect_right,
+                     'hunt_interval': huntInterval,
+                     'hermite_weights': hermiteWeights,
+                     'out_of_range': self._out_of_range,
+                     'nan': NAN, 'Error': Error,
+                     'hunt': [hunt_i or 0 for hunt_i in self._hunt]}
+        # Flat values (and derivatives, for cubic axes) of each output,
+        # by mask of the cubic axes differentiated along.
+        if self._cubic_mask:
+            tables = [dict([(mask, flat.tolist())
+                            for mask, flat in table_flats.items()])
+                      for table_flats in self._hermite()[0]]
+        else:
+            value_tables = self._valueTables()
+            if self.storage == 'array':
+                value_tables = self._arrays()[1]
+            tables = [{0: self._flatValues(value_table)}
+                      for value_table in value_tables]
+        for table_i in range(len(tables)):
+            for mask, values in tables[table_i].items():
+                namespace['values%d_%d' % (table_i, mask)] = values
+        arg_names = ['x%d' % self.axis_names[axis_name]
+                     for axis_name in axis_names]
+        lines = ['def lookup(%s):' % ', '.join(arg_names)]
+
+        # Interval search, and the offsets of the point within the interval.
+        stride = 1
+        strides = [None] * n_axes
+        for axis_i in range(n_axes - 1, -1, -1):
+            axis = [float(axis_value) for axis_value in self.axes[axis_i]]
+            namespace['axis%d' % axis_i] = axis
+            # Searching the interior breakpoints gives the interval start
+            # already limited to 0..len(axis) - 2.
+            namespace['inner%d' % axis_i] = axis[1:-1]
+            strides[axis_i] = stride
+            stride *= len(axis)
+        for axis_i in range(n_axes):
+            if self._hunt[axis_i] is None:
+                lines.append('    i%d = bisect_right(inner%d, x%d)'
+                             % (axis_i, axis_i, axis_i))
+            else:
+                # Check the previous interval inline before calling out.
+                last_start_i = len(self.axes[axis_i]) - 2
+                lines += [
+                    '    i%d = hunt[%d]' % (axis_i, axis_i),
+                    '    if not ((i%d == 0 or axis%d[i%d] <= x%d) and'
+                    % (axis_i, axis_i, axis_i, axis_i),
+                    '            (i%d == %d or x%d < axis%d[i%d + 1])):'
+                    % (axis_i, last_start_i, axis_i, axis_i, axis_i),
+                    '        i%d = hunt[%d] = hunt_interval(axis%d, x%d, i%d)'
+                    % (axis_i, axis_i, axis_i, axis_i, axis_i)]
+            # Count values beyond the ends, and apply the policy.
+            axis = namespace['axis%d' % axis_i]
+            policy = self.extrapolation[axis_i]
+            lines.append('    if not %r <= x%d <= %r:'
+                         % (axis[0], axis_i, axis[-1]))
+            for side, test, bound in ((0, '<', axis[0]), (1, '>', axis[-1])):
+                lines += [
+                    '        %s x%d %s %r:' % (side and 'elif' or 'if',
+                                              axis_i, test, bound),
+                    '            out_of_range[%d][%d] += 1' % (axis_i, side)]
+                if policy == 'clamp':
+                    lines.append('            x%d = %r' % (axis_i, bound))
+                elif policy == 'nan':
+                    lines.append('            x%d = nan' % axis_i)
+                elif policy == 'raise':
+                    lines.append('            raise Error("Value %%r out of '
+                                 'range for axis \'%s\'" %% x%d)'
+                                 % (self.getAxisName(axis_i), axis_i))
+            lines += [
+                '    lo%d = axis%d[i%d]' % (axis_i, axis_i, axis_i),
+                '    dx%d = x%d - lo%d' % (axis_i, axis_i, axis_i),
+                '    span%d = axis%d[i%d + 1] - lo%d'
+                % (axis_i, axis_i, axis_i, axis_i)]
+            if self._cubic_mask & (1 << axis_i):
+                lines.append('    wy1_%d, wd1_%d, wy2_%d, wd2_%d = '
+                             'hermite_weights(dx%d, span%d)'
+                             % ((axis_i,) * 6))
+        lines.append('    offset = %s' % ' + '.join(
+            ['i%d * %d' % (axis_i, strides[axis_i])
+             for axis_i in range(n_axes)]))
+
+        # Corner values, first axis most significant.
+        corner_offsets = [0]
+        for axis_i in range(n_axes):
+            corner_offsets = [corner_offset + bit * strides[axis_i]
+                              for corner_offset in corner_offsets
+                              for bit in (0, 1)]
+        results = []
+        for table_i in range(len(tables)):
+            masks = tables[table_i].keys()
+            masks.sort()
+            for mask in masks:
+                for corner_i, corner_offset in enumerate(corner_offsets):
+                    lines.append('    t%d_%d_%d_%d = values%d_%d[offset + %d]'
+                                 % (table_i, mask, n_axes, corner_i, table_i,
+                                    mask, corner_offset))
+
+            # Reduce one axis at a time, starting with the last (as interp_n
+            # and interp_hermite).
+            for axis_i in range(n_axes - 1, -1, -1):
+                bit = 1 << axis_i
+                if self._cubic_mask & bit:
+                    masks = [mask for mask in masks if not mask & bit]
+                for mask in masks:
+                    for corner_i in range(2 ** axis_i):
+                        lower, upper = [
+                            't%d_%d_%d_%d' % (table_i, mask, axis_i + 1,
+                                              2 * corner_i + bit_i)
+                            for bit_i in (0, 1)]
+                        target = 't%d_%d_%d_%d' % (table_i, mask, axis_i,
+                                                   corner_i)
+                        if not self._cubic_mask & bit:
+                            lines.append('    %s = (%s - %s) / span%d * dx%d'
+                                         ' + %s' % (target, upper, lower,
+                                                    axis_i, axis_i, lower))
+                            continue
+                        d_lower, d_upper = [
+                            't%d_%d_%d_%d' % (table_i, mask | bit, axis_i + 1,
+                                              2 * corner_i + bit_i)
+                            for bit_i in (0, 1)]
+                        lines.append('    %s = wy1_%d * %s + wd1_%d * %s + '
+                                     'wy2_%d * %s + wd2_%d * %s'
+                                     % (target, axis_i, lower, axis_i, d_lower,
+                                        axis_i, upper, axis_i, d_upper))
+            results.append('t%d_0_0_0' % table_i)
+        if self.output_tables:
+            lines.append('    return (%s,)' % ', '.join(results))
+        else:
+            lines.append('    return %s' % results[0])
+
+        exec '\n'.join(lines) + '\n' in namespace
+        return namespace['lookup']
+
+    def resample(self, new_axes):
+        """Return (table, report) for the table interpolated on new axes.
+
+        new_axes -- {axis_name: axis_values} for the axes to change; the
+                    other axes keep their breakpoints
+
+        The new values are found by batched interpolation (lookup_many) of
+        this table, so beyond its axes they follow its extrapolation
+        policies.  The new table has the same storage, kernel, dtypes
+        (and scalings), outputs, interpolation methods and extrapolation
+        policies.
+
+        report -- {'max_error', 'rms_error', 'size', 'original_size',
+                   'reduction'}: the errors of the new table at the
+                  breakpoints of this one (over all the outputs), the number
+                  of values per output of each table, and the fraction of
+                  values saved (negative when refining)
+
+        This requires numpy.
+
+        """
+        if numpy is None:
+            raise Error("resample requires numpy")
+        for axis_name in new_axes.keys():
+            if axis_name not in self.axis_names:
+                raise Error("No axis with name: '%s'" % axis_name)
+        axes = []
+        for axis_i in range(len(self.axes)):
+            axis_values = new_axes.get(self.getAxisName(axis_i))
+            if axis_values is None:
+                axis_values = self.axes[axis_i]
+            axes.append([float(axis_value) for axis_value in axis_values])
+        values = self.lookup_many(**self._grid(axes))
+        if not self.output_tables:
+            values = (values,)
+        table = self._derived(axes, values)
+        return table, self._errorReport(table)
+
+    def decimate(self, tol):
+        """Return (table, report) with the breakpoints not needed within tol.
+
+        Interior breakpoints are removed greedily while the new table
+        reproduces all the values of this one (every output, at every
+        breakpoint) within tol.  Each pass tries the removals in order of
+        the error each would cause alone, rechecking each one against the
+        breakpoints removed so far, until a pass removes nothing.  The
+        kept values are not changed, and the end breakpoints are kept.
+
+        The interpolation methods of the table are used to check the
+        error, so cubic axes can keep fewer breakpoints.  See resample for
+        the report.
+
+        >>> lut_d = LookupTable()
+        >>> lut_d.addAxis('x', [0., 1., 2., 3., 4.])
+        >>> lut_d.setValueTable([0., 1., 2., 4., 6.])
+        >>> for tol in (0.01, 1.):
+        ...     table, report = lut_d.decimate(tol)
+        ...     print table.axes[0], table.value_table, report['max_error'],
+        ...     print report['reduction']
+        [0.0, 2.0, 4.0] [0.0, 2.0, 6.0] 0.0 0.4
+        [0.0, 4.0] [0.0, 6.0] 1.0 0.6
+
+        This requires numpy.
+
+        """
+        if numpy is None:
+            raise Error("decimate requires numpy")
+        axes, value_tables = self._arrays()
+        grid = self._grid(axes)
+        kept = [range(len(axis)) for axis in axes]
+
+        def error(kept):
+            # (The trial tables use array storage, whatever this one uses.)
+            table = self._derived(
+                [axes[axis_i][kept[axis_i]] for axis_i in range(len(axes))],
+                [value_table[numpy.ix_(*kept)]
+                 for value_table in value_tables], 'array')
+            values = table.lookup_many(**grid)
+            if not self.output_tables:
+                values = (values,)
+            return max([abs(new - numpy.asarray(old)).max()
+                        for new, old in zip(values, value_tables)])
+
+        removed = True
+        while removed:
+            removed = False
+            candidates = []
+            for axis_i in range(len(axes)):
+                for breakpoint_i in kept[axis_i][1:-1]:
+                    trial = kept[:]
+                    trial[axis_i] = [i for i in kept[axis_i]
+                                     if i != breakpoint_i]
+                    candidates.append((error(trial), axis_i, breakpoint_i))
+            candidates.sort()
+            for candidate_error, axis_i, breakpoint_i in candidates:
+                if candidate_error > tol:
+                    break
+                if breakpoint_i not in kept[axis_i][1:-1]:
+                    continue
+                trial = kept[:]
+                trial[axis_i] = [i for i in kept[axis_i] if i != breakpoint_i]
+                if error(trial) <= tol:
+                    kept = trial
+                    removed = True
+
+        table = self._derived(
+            [axes[axis_i][kept[axis_i]] for axis_i in range(len(axes))],
+            [value_table[numpy.ix_(*kept)] for value_table in value_tables])
+        return table, self._errorReport(table)
+
+    def _grid(self, axes):
+        """Return {axis_name: array} of all the points on the given axes."""
+        grid = {}
+        points = numpy.meshgrid(*axes, **{'indexing': 'ij'})
+        for axis_i in range(len(axes)):
+            grid[self.getAxisName(axis_i)] = points[axis_i]
+        return grid
+
+    def _derived(self, axes, value_tables, storage=None):
+        """Return a table like this one, on other axes and values.
+
+        storage -- storage of the new table (default: as this one)
+
+        The new table has the same dtypes, and scalings for the integer
+        ones.
+
+        """
+        storage = storage or self.storage
+        table = self.__class__(storage=storage, kernel=self.kernel,
+                               uniform=self.uniform, dtype=self.dtype,
+                               axis_dtype=self.axis_dtype)
+        for axis_i in range(len(axes)):
+            axis_name = self.getAxisName(axis_i)
+            axis_values = [float(axis_value) for axis_value in axes[axis_i]]
+            table.addAxis(axis_name, axis_values,
+                          *(self.axis_scaling[axis_i] or ()))
+            table.setInterpMethod(axis_name, self.interp_methods[axis_i])
+            table.setExtrapolation(axis_name, self.extrapolation[axis_i])
+        for table_i in range(len(value_tables)):
+            value_table = value_tables[table_i]
+            scaling = self.value_scaling[table_i] or ()
+            if storage == 'list':
+                value_table = numpy.asarray(value_table).tolist()
+            if self.output_tables:
+                table.addOutput(self.getOutputName(table_i), value_table,
+                                *scaling)
+            else:
+                table.setValueTable(value_table, *scaling)
+        return table
+
+    def _errorReport(self, table):
+        """Return the resample report of table against this table."""
+        axes, value_tables = self._arrays()
+        values = table.lookup_many(**self._grid(axes))
+        if not self.output_tables:
+            values = (values,)
+        errors = numpy.concatenate([(new - numpy.asarray(old)).ravel()
+                                    for new, old
+                                    in zip(values, value_tables)])
+        size = 1
+        for axis in table.axes:
+            size *= len(axis)
+        original_size = 1
+        for axis in self.axes:
+            original_size *= len(axis)
+        return {'max_error': float(abs(errors).max()),
+                'rms_error': float(numpy.sqrt((errors * errors).mean())),
+                'size': size, 'original_size': original_size,
+                'reduction': 1.0 - float(size) / original_size}
+
+    def save(self, path):
+        """Save the table to a binary file, for load().
+
+        The file holds a magic string, the header length (little-endian
+        uint32), a JSON header with the axis names and values, the output
+        names, the dtypes and scalings and the interpolation methods and
+        extrapolation policies of the axes, padded to a multiple of 64
+        bytes, and then the value tables as raw little-endian values of
+        the table dtype in C order, one after another.
+
+        This requires numpy.
+
+        """
+        if numpy is None or json is None:
+            raise Error("save requires numpy and json")
+        if not len(self.value_table):
+            raise Error("No values set for lookup table")
+        axes = []
+        for axis_i in range(len(self.axes)):
+            axes.append([self.getAxisName(axis_i),
+                         [float(axis_value)
+                          for axis_value in self.axes[axis_i]]])
+        outputs = None
+        if self.output_tables:
+            outputs = [self.getOutputName(table_i)
+                       for table_i in range(len(self.output_tables))]
+        dtype = numpy.dtype(self.dtype).newbyteorder('<')
+        header = json.dumps({'version': FILE_VERSION, 'dtype': dtype.str,
+                             'axes': axes, 'outputs': outputs,
+                             'axis_dtype': self.axis_dtype,
+                             'axis_scaling': self.axis_scaling,
+                             'value_scaling': self.value_scaling,
+                             'interp_methods': self.interp_methods,
+                             'extrapolation': self.extrapolation})
+        data_offset = len(FILE_MAGIC) + 4 + len(header)
+        padding = -data_offset % 64
+        shape = tuple([len(axis) for axis in self.axes])
+
+        lut_file = open(path, 'wb')
+        try:
+            lut_file.write(FILE_MAGIC)
+            lut_file.write(struct.pack('<I', len(header) + padding))
+            lut_file.write(header + ' ' * padding)
+            for value_table in self._valueTables():
+                values = numpy.asarray(value_table, dtype=dtype)
+                if values.shape != shape:
+                    raise Error("Value table shape %s does not match axes %s"
+                                % (values.shape, shape))
+                values.tofile(lut_file)
+        finally:
+            lut_file.close()
+
+    def load(cls, path, mmap=True, kernel='recursive'):
+        """Return a table (with array storage) read from a save() file.
+
+        mmap -- map the value block of the file into memory (read-only)
+                rather than reading it.  The data are then only read as
+                they are used, and processes loading the same file share
+                one physical copy.
+
+        This requires numpy.
+
+        """
+        if numpy is None or json is None:
+            raise Error("load requires numpy and json")
+        lut_file = open(path, 'rb')
+        try:
+            if lut_file.read(len(FILE_MAGIC)) != FILE_MAGIC:
+                raise Error("Not a lookup table file: '%s'" % path)
+            header_len = struct.unpack('<I', lut_file.read(4))[0]
+            header = json.loads(lut_file.read(header_len))
+            if header['version'] != FILE_VERSION:
+                raise Error("Unknown lookup table file version: %s"
+                            % header['version'])
+            shape = tuple([len(axis_values)
+                           for name, axis_values in header['axes']])
+            n_tables = len(header['outputs'] or [None])
+            data_offset = len(FILE_MAGIC) + 4 + header_len
+            if mmap:
+                values = numpy.memmap(path, dtype=header['dtype'], mode='r',
+                                      offset=data_offset,
+                                      shape=(n_tables,) + shape)
+            else:
+                values = numpy.fromfile(lut_file, dtype=header['dtype'],
+                                        count=n_tables
+                                        * numpy.prod(shape, dtype=int))
+                values = values.reshape((n_tables,) + shape)
+        finally:
+            lut_file.close()
+
+        # (Files from before the dtypes were added hold float64 values.)
+        lut = cls(storage='array', kernel=kernel,
+                  dtype=numpy.dtype(header['dtype']).name,
+                  axis_dtype=header.get('axis_dtype', 'float64'))
+        axis_scaling = header.get('axis_scaling') or [None] * len(shape)
+        for (name, axis_values), scaling in zip(header['axes'],
+                                                axis_scaling):
+            lut.addAxis(str(name), axis_values, *(scaling or ()))
+        interp_methods = header.get('interp_methods') or []
+        for axis_i in range(len(interp_methods)):
+            if interp_methods[axis_i] != 'linear':
+                lut.setInterpMethod(lut.getAxisName(axis_i),
+                                    str(interp_methods[axis_i]))
+        extrapolation = header.get('extrapolation') or []
+        for axis_i in range(len(extrapolation)):
+            lut.setExtrapolation(lut.getAxisName(axis_i),
+                                 str(extrapolation[axis_i]))
+        value_scaling = header.get('value_scaling') or [None] * n_tables
+        lut.value_scaling = [scaling and tuple(scaling)
+                             for scaling in value_scaling]
+        if header['outputs'] is None:
+            lut.value_table = values[0]
+        else:
+            for table_i in range(n_tables):
+                lut.output_names[str(header['outputs'][table_i])] = table_i
+                lut.output_tables.append(values[table_i])
+            lut.value_table = lut.output_tables[0]
+        return lut
+    load = classmethod(load)
+
+    def from_function(cls, func, axes, workers=None, checkpoint=None,
+                      outputs=None, chunk_size=None, storage='array',
+                      kernel='recursive'):
+        """Return a table of func evaluated at every point of the axes.
+
+        func -- called as func(x, y, ...) with the axis values of a point,
+                in axis order; returns the value, or a sequence of a value
+                per output when outputs are named
+        axes -- [(axis_name, axis_values), ...] in axis order
+        workers -- number of processes evaluating chunks of the points in
+                   parallel (None or 1 to evaluate them in this process).
+                   func must then be picklable, e.g. a module level function.
+        checkpoint -- path of a file to keep the values in as the chunks
+                      are done (a .npy file, with path + '.done' marking the
+                      finished chunks and path + '.key' recording the
+                      axes, outputs, chunk_size and the module and name of
+                      func).  If the files exist, as left by an interrupted
+                      run with the same key, only the missing chunks are
+                      evaluated; with another key an Error is raised.
+                      Delete the files after changing the code of func.
+        outputs -- names of the outputs, for a func returning several
+                   values
+        chunk_size -- number of points per chunk (default: enough for
+                      about 4 chunks per worker, at most 10000 points)
+
+        The values are assembled in one contiguous float64 array per
+        output.  This requires numpy.
+
+        """
+        if numpy is None:
+            raise Error("from_function requires numpy")
+        axes = [(axis_name, [float(axis_value) for axis_value in axis_values])
+                for axis_name, axis_values in axes]
+        shape = tuple([len(axis_values) for axis_name, axis_values in axes])
+        size = int(numpy.prod(shape, dtype=int))
+        n_outputs = len(outputs or [None])
+        if not chunk_size:
+            chunk_size = min(max(size // (4 * (workers or 1)), 1), 10000)
+        chunks = [(func, axes, start, min(start + chunk_size, size))
+                  for start in range(0, size, chunk_size)]
+
+        if checkpoint is None:
+            values = numpy.empty((n_outputs, size))
+            done = numpy.zeros(len(chunks), dtype=numpy.uint8)
+        else:
+            key = {'axes': axes, 'outputs': outputs, 'chunk_size': chunk_size,
+                   'func': [getattr(func, '__module__', None),
+                            getattr(func, '__name__',
+                                    func.__class__.__name__)]}
+            values, done = openCheckpoint(checkpoint, (n_outputs, size),
+                                          len(chunks), key)
+        todo = [chunk_i for chunk_i in range(len(chunks))
+                if not done[chunk_i]]
+
+        def store(chunk_i, chunk_values):
+            start, stop = chunks[chunk_i][2:]
+            values[:, start:stop] = chunk_values.T
+            if checkpoint is not None:
+                # Write the values before marking the chunk done.
+                values.flush()
+                done[chunk_i] = 1
+                done.flush()
+
+        if workers and workers > 1 and len(todo) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(workers)
+            try:
+                for chunk_i, chunk_values in pool.imap_unordered(
+                        evaluateChunk, [(chunk_i,) + chunks[chunk_i]
+                                        for chunk_i in todo]):
+                    store(chunk_i, chunk_values)
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for chunk_i in todo:
+                store(*evaluateChunk((chunk_i,) + chunks[chunk_i]))
+
+        lut = cls(storage=storage, kernel=kernel)
+        for axis_name, axis_values in axes:
+            lut.addAxis(axis_name, axis_values)
+        for table_i in range(n_outputs):
+            value_table = numpy.array(values[table_i]).reshape(shape)
+            if storage == 'list':
+                value_table = value_table.tolist()
+            if outputs:
+                lut.addOutput(outputs[table_i], value_table)
+            else:
+                lut.setValueTable(value_table)
+        return lut
+    from_function = classmethod(from_function)
+
+    def _flatValues(self, value_table):
+        """Return a value table as a flat list, in C order."""
+        if self.storage == 'array':
+            return numpy.asarray(value_table).ravel().tolist()
+        values = value_table
+        while len(values) and hasattr(values[0], '__len__'):
+            values = [value for sub_table in values for value in sub_table]
+        return [float(value) for value in values]
+
+
+class ScaledArray:
+    """Integer codes decoded to values as they are indexed.
+
+    value = code * scale + offset, computed in float64 and rounded to
+    dtype.  Indexing returns a decoded array (or scalar) and
+    numpy.asarray decodes the whole array.
+
+    """
+
+    def __init__(self, codes, scaling, dtype):
+        self.codes = codes
+        self.scale, self.offset = scaling
+        self.dtype = numpy.dtype(dtype)
+        self.shape = codes.shape
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        return (self.codes[index] * self.scale
+                + self.offset).astype(self.dtype)
+
+    def __array__(self, dtype=None):
+        return (self.codes * self.scale + self.offset).astype(
+            dtype or self.dtype)
+
+
+def quantizeValues(values, dtype, scale=None, offset=None):
+    """Return (stored, scaling) for a float64 array of values.
+
+    stored -- values as an array of dtype (one of STORAGE_DTYPES)
+    scaling -- (scale, offset) of the codes of the integer dtypes, with
+               value = code * scale + offset, None for the float dtypes
+
+    By default the scale and offset map the range of the values onto the
+    full range of the codes.  Values out of range of the codes raise an
+    Error.
+
+    """
+    if dtype in ('float64', 'float32'):
+        if scale is not None or offset is not None:
+            raise Error("Scale and offset need an integer dtype")
+        return values.astype(dtype), None
+    code_max = numpy.iinfo(dtype).max
+    if not numpy.isfinite(values).all():
+        raise Error("Cannot store non-finite values as %s" % dtype)
+    if values.size:
+        low = float(values.min())
+        high = float(values.max())
+    else:
+        low = high = 0.0
+    if offset is None:
+        offset = 0.5 * (low + high)
+    if scale is None:
+        scale = max(high - offset, offset - low) / code_max or 1.0
+    codes = numpy.round((values - offset) / scale)
+    if values.size and (codes.min() < -code_max - 1 or codes.max() > code_max):
+        raise Error("Values out of range of %s with scale %r and offset %r"
+                    % (dtype, scale, offset))
+    return codes.astype(dtype), (float(scale), float(offset))
+
+
+def uniformSpacing(axis_values, tolerance=1e-9):
+    """Return (start, 1 / step) if the axis values are evenly increasing.
+
+    Return None if they are not (or there are fewer than two of them).
+    tolerance is relative to the step.
+
+    """
+    if axis_values is None or len(axis_values) < 2:
+        return None
+    start = float(axis_values[0])
+    step = (float(axis_values[-1]) - start) / (len(axis_values) - 1)
+    if not step > 0:
+        return None
+    for axis_i in range(len(axis_values)):
+        if (abs(axis_values[axis_i] - (start + axis_i * step))
+                > tolerance * step):
+            return None
+    return start, 1.0 / step
+
+
+def huntInterval(axis, axis_value, guess):
+    """Return the interval start index of axis_value, searching from guess.
+
+    The interval starting at guess is checked first, then the neighbouring
+    interval in the direction of travel, and only then is the rest of the
+    axis searched.  The result is the same as
+    bisect_right(axis, axis_value) - 1, limited to 0..len(axis) - 2.
+
+    guess -- interval start index (0..len(axis) - 2), e.g. from the
+             previous lookup
+
+    """
+    last_start_i = len(axis) - 2
+    if guess == 0 or axis[guess] <= axis_value:
+        if guess == last_start_i or axis_value < axis[guess + 1]:
+            return guess
+        # Moved up.
+        guess += 1
+        if guess == last_start_i or axis_value < axis[guess + 1]:
+            return guess
+        interval_start_i = bisect_right(axis, axis_value, guess + 1) - 1
+    else:
+        # Moved down.
+        guess -= 1
+        if guess == 0 or axis[guess] <= axis_value:
+            return guess
+        interval_start_i = bisect_right(axis, axis_value, 0, guess) - 1
+    if interval_start_i > last_start_i:
+        interval_start_i = last_start_i
+    elif interval_start_i < 0:
+        interval_start_i = 0
+    return interval_start_i
+
+
+def hermiteWeights(offset, span):
+    """Return the cubic Hermite weights (wy1, wd1, wy2, wd2) of a point.
+
+    The interpolated value is wy1 * y1 + wd1 * d1 + wy2 * y2 + wd2 * d2,
+    where y1, y2 are the values and d1, d2 the slopes at the interval ends.
+    Outside the interval (before the first or after the last one) the
+    weights extrapolate linearly along the end slope.
+
+    offset -- x - x1
+    span -- x2 - x1
+
+    """
+    t = offset / span
+    if t < 0.0:
+        return 1.0, offset, 0.0, 0.0
+    if t > 1.0:
+        return 0.0, 0.0, 1.0, offset - span
+    s = 1.0 - t
+    return ((1.0 + 2.0 * t) * s * s, t * s * s * span,
+            t * t * (3.0 - 2.0 * t), t * t * (t - 1.0) * span)
+
+
+def hermiteWeightsMany(offset, span):
+    """Vectorized equivalent of hermiteWeights, for numpy arrays."""
+    t = offset / span
+    s = 1.0 - t
+    weights = [(1.0 + 2.0 * t) * s * s, t * s * s * span,
+               t * t * (3.0 - 2.0 * t), t * t * (t - 1.0) * span]
+    with numpy.errstate(invalid='ignore'):
+        below = t < 0.0
+        above = t > 1.0
+    return [numpy.where(below, weight_below,
+                        numpy.where(above, weight_above, weight))
+            for weight, weight_below, weight_above
+            in zip(weights, (1.0, offset, 0.0, 0.0),
+                   (0.0, 0.0, 1.0, offset - span))]
+
+
+def hermiteSlopeWeights(offset, span):
+    """Return the weights (sy1, sd1, sy2, sd2) of the derivative at a point.
+
+    These are the derivatives of the hermiteWeights with respect to x, so
+    the slope of the interpolating cubic is
+    sy1 * y1 + sd1 * d1 + sy2 * y2 + sd2 * d2.
+
+    """
+    t = offset / span
+    if t < 0.0:
+        return 0.0, 1.0, 0.0, 0.0
+    if t > 1.0:
+        return 0.0, 0.0, 0.0, 1.0
+    return (6.0 * t * (t - 1.0) / span, (1.0 - t) * (1.0 - 3.0 * t),
+            6.0 * t * (1.0 - t) / span, t * (3.0 * t - 2.0))
+
+
+def hermiteSlopeWeightsMany(offset, span):
+    """Vectorized equivalent of hermiteSlopeWeights, for numpy arrays."""
+    t = offset / span
+    weights = [6.0 * t * (t - 1.0) / span, (1.0 - t) * (1.0 - 3.0 * t),
+               6.0 * t * (1.0 - t) / span, t * (3.0 * t - 2.0)]
+    with numpy.errstate(invalid='ignore'):
+        below = t < 0.0
+        above = t > 1.0
+    return [numpy.where(below, weight_below,
+                        numpy.where(above, weight_above, weight))
+            for weight, weight_below, weight_above
+            in zip(weights, (0.0, 1.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))]
+
+
+def axisSlopes(values, axis, axis_i, method):
+    """Return the slopes of an array of values along one axis.
+
+    The slopes at the breakpoints are estimated by the given method
+    ('pchip', 'akima' or 'spline', see LookupTable.setInterpMethod) from
+    the values alone, independently for each line along the axis.  With
+    only two breakpoints every method gives the slope of the line.
+
+    values -- numpy array of table values
+    axis -- numpy array of the breakpoints of axis axis_i
+
+    """
+    values = numpy.rollaxis(numpy.asarray(values, dtype=numpy.float64),
+                            axis_i)
+    n_points = len(axis)
+    # Interval widths and secant slopes, broadcast along the other axes.
+    widths = numpy.diff(axis).reshape((n_points - 1,)
+                                      + (1,) * (values.ndim - 1))
+    secants = numpy.diff(values, axis=0) / widths
+    slopes = numpy.empty(values.shape)
+    if n_points == 2:
+        slopes[:] = secants[0]
+    elif method == 'pchip':
+        # Fritsch-Carlson: weighted harmonic mean of the secants where they
+        # have the same sign, zero at a local extremum.
+        w1 = 2 * widths[1:] + widths[:-1]
+        w2 = widths[1:] + 2 * widths[:-1]
+        same_sign = secants[:-1] * secants[1:] > 0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            harmonic = (w1 + w2) / (w1 / secants[:-1] + w2 / secants[1:])
+        slopes[1:-1] = numpy.where(same_sign, harmonic, 0.0)
+        # One-sided three point ends, limited to keep the shape monotone.
+        for end, width, next_width, secant, next_secant in (
+                (0, widths[0], widths[1], secants[0], secants[1]),
+                (-1, widths[-1], widths[-2], secants[-1], secants[-2])):
+            slope = (((2 * width + next_width) * secant - width * next_secant)
+                     / (width + next_width))
+            slope = numpy.where(numpy.sign(slope) != numpy.sign(secant),
+                                0.0, slope)
+            slope = numpy.where((numpy.sign(secant) != numpy.sign(next_secant))
+                                & (abs(slope) > abs(3 * secant)),
+                                3 * secant, slope)
+            slopes[end] = slope
+    elif method == 'akima':
+        # Extend the secants by two at each end, by linear extrapolation.
+        extended = numpy.empty((n_points + 3,) + values.shape[1:])
+        extended[2:-2] = secants
+        extended[1] = 2 * extended[2] - extended[3]
+        extended[0] = 2 * extended[1] - extended[2]
+        extended[-2] = 2 * extended[-3] - extended[-4]
+        extended[-1] = 2 * extended[-2] - extended[-3]
+        changes = abs(numpy.diff(extended, axis=0))
+        f1 = changes[2:]
+        f2 = changes[:-2]
+        f12 = f1 + f2
+        # Where the secants do not change, use the mean of the neighbours.
+        slopes[:] = 0.5 * (extended[3:] + extended[:-3])
+        weighted = f12 > 1e-9 * f12.max()
+        slopes[weighted] = ((f1 * extended[1:-2] + f2 * extended[2:-1])
+                            [weighted] / f12[weighted])
+    elif method == 'spline':
+        # Natural spline: solve the tridiagonal system for the second
+        # derivatives (zero at the ends), then take the slopes.
+        curvatures = numpy.zeros(values.shape)
+        diagonal = 2 * (widths[:-1] + widths[1:])
+        rhs = 6 * (secants[1:] - secants[:-1])
+        upper = numpy.empty(rhs.shape)
+        for i in range(n_points - 2):
+            if i:
+                pivot = diagonal[i] - widths[i] * upper[i - 1]
+                rhs[i] = (rhs[i] - widths[i] * rhs[i - 1]) / pivot
+            else:
+                pivot = diagonal[i]
+                rhs[i] = rhs[i] / pivot
+            upper[i] = widths[i + 1] / pivot
+        for i in range(n_points - 3, -1, -1):
+            curvatures[i + 1] = rhs[i]
+            if i < n_points - 3:
+                curvatures[i + 1] -= upper[i] * curvatures[i + 2]
+        slopes[:-1] = secants - widths * (2 * curvatures[:-1]
+                                          + curvatures[1:]) / 6
+        slopes[-1] = secants[-1] + widths[-1] * (curvatures[-2]
+                                                 + 2 * curvatures[-1]) / 6
+    else:
+        raise Error("Unknown interpolation method: '%s'" % method)
+    return numpy.rollaxis(slopes, 0, axis_i + 1)
+
+
+def evaluateChunk(chunk):
+    """Return (chunk_i, values) of a function on a range of grid points.
+
+    chunk -- (chunk_i, func, axes, start, stop): func and axes as for
+             LookupTable.from_function, and the range of flat (C-order)
+             point indexes to evaluate
+
+    values -- (stop - start, number of outputs) float64 array
+
+    """
+    chunk_i, func, axes, start, stop = chunk
+    shape = [len(axis_values) for axis_name, axis_values in axes]
+    indexes = numpy.unravel_index(numpy.arange(start, stop), shape)
+    values = []
+    for point_i in range(stop - start):
+        point = [axes[axis_i][1][indexes[axis_i][point_i]]
+                 for axis_i in range(len(axes))]
+        values.append(func(*point))
+    values = numpy.array(values, dtype=numpy.float64)
+    return chunk_i, values.reshape((stop - start, -1))
+
+
+def openCheckpoint(path, shape, n_chunks, key):
+    """Return (values, done) memory maps of a from_function checkpoint.
+
+    The files are created if they do not exist yet, and checked against
+    the key, shape and number of chunks if they do.
+
+    values -- float64 array of the given shape, in the .npy file at path
+    done -- uint8 array, 1 for each finished chunk, in path + '.done'
+    key -- what the values were made from (JSON serializable), kept in
+           path + '.key'
+
+    """
+    import os
+    from numpy.lib.format import open_memmap
+    if json is None:
+        raise Error("Checkpoints require json")
+    done_path = path + '.done'
+    key_path = path + '.key'
+    key = json.loads(json.dumps(key))
+    if os.path.exists(path) and os.path.exists(done_path):
+        old_key = None
+        if os.path.exists(key_path):
+            key_file = open(key_path, 'rb')
+            try:
+                old_key = json.load(key_file)
+            finally:
+                key_file.close()
+        if old_key != key:
+            raise Error("Checkpoint '%s' is for another table, function or"
+                        " chunk size" % path)
+        values = open_memmap(path, mode='r+')
+        done = numpy.memmap(done_path, dtype=numpy.uint8, mode='r+')
+        if values.shape != shape or len(done) != n_chunks:
+            raise Error("Checkpoint '%s' is for another table or chunk size"
+                        % path)
+    else:
+        key_file = open(key_path, 'wb')
+        try:
+            json.dump(key, key_file)
+        finally:
+            key_file.close()
+        values = open_memmap(path, mode='w+', dtype=numpy.float64,
+                             shape=shape)
+        done = numpy.memmap(done_path, dtype=numpy.uint8, mode='w+',
+                            shape=(n_chunks,))
+    return values, done
+
+
+def frozenTable(value_table):
+    """Return a read-only version of a value table (or axis).
+
+    numpy arrays are made read-only in place (ScaledArrays through their
+    codes), and nested sequences are converted to nested tuples.
+
+    """
+    if isinstance(value_table, ScaledArray):
+        frozenTable(value_table.codes)
+    elif numpy is not None and isinstance(value_table, numpy.ndarray):
+        value_table.flags.writeable = False
+    elif hasattr(value_table, '__len__'):
+        value_table = tuple([frozenTable(sub_table)
+                             for sub_table in value_table])
+    return value_table
+
 
 def nestedSequenceSize(nested_sequence):
-    """Return tuple of the size of each level of nested sequence.
+    """Return tuple of the size of each level of nested sequence,
+    outermost level first.
 
     Strings and not treated as sequences.
 
@@ -487,7 +3257,7 @@ def nestedSequenceSize(nested_sequence):
     if first_sub_sequence_size is None:
         return (level_len,)
     else:
-        return first_sub_sequence_size + (level_len,)
+        return (level_len,) + first_sub_sequence_size
 
 
 def crosscheck2d():
@@ -0,0 +1,455 @@
+"""Define a lookup table class for scattered (not gridded) data.
+
+LookupTable needs a value at every point of a rectilinear grid.
+ScatteredTable takes the values at any set of points, e.g. a test
+matrix with missing points, and interpolates linearly within the
+Delaunay simplices (triangles, tetrahedra, ...) of the points, or
+weights the nearest points by inverse distance, or takes the nearest
+point.
+
+The Delaunay triangulation is the most accurate for two or three axes.
+For more axes it grows quickly, and points taken from a grid (as test
+matrices usually are) make it degenerate, so that finding the simplex
+of a point gets slow; use the inverse distance ('idw') method there.
+
+- axes are named and added in order, as for LookupTable, but each axis
+  holds one coordinate per point rather than breakpoints
+- the simplex (or KD-tree) index is built once, when first needed after
+  the points or values are set, and lookups are batched
+- this module is units-agnostic; the axes are scaled to the range of
+  their coordinates before the index is built
+
+This requires numpy and scipy (scipy.spatial).
+
+The unittests (doctest) can be run by running this script directly with Python:
+python scattered_table.py
+
+"""
+
+from lookup_table import Error
+
+try:
+    import numpy
+    from scipy.spatial import Delaunay, cKDTree
+except ImportError:
+    # numpy and scipy are only needed for scattered tables.
+    numpy = None
+
+
+class ScatteredTable:
+    """Lookup table on scattered points
+
+    A plane sampled on a 3 x 3 grid with two of the points missing:
+
+    >>> points = [(0., 0.), (1., 0.), (2., 0.), (0., 1.), (1., 1.),
+    ...           (0., 2.), (2., 2.)]
+    >>> def example_2var_func(x, y):
+    ...     return (2 * x) + (3 * y) + 1
+    >>> st = ScatteredTable()
+    >>> st.addAxis('x', [x for x, y in points])
+    >>> st.addAxis('y', [y for x, y in points])
+    >>> st.setValueTable([example_2var_func(x, y) for x, y in points])
+    >>> print st.validate()
+    True
+
+    Linear interpolation within the simplices is exact for a plane:
+
+    >>> print st.lookup(x=1.5, y=1.25), example_2var_func(1.5, 1.25)
+    7.75 7.75
+    >>> print st.lookup_many(x=[0.5, 1.5], y=[0.5, 0.])
+    [3.5 4. ]
+
+    Outside the convex hull of the points the nearest point is used (or
+    NaN, or an Error, see __init__):
+
+    >>> print st.lookup(x=3., y=0.)
+    5.0
+    >>> st_nan = ScatteredTable(outside='nan')
+    >>> st_nan.addAxis('x', [x for x, y in points])
+    >>> st_nan.addAxis('y', [y for x, y in points])
+    >>> st_nan.setValueTable([example_2var_func(x, y) for x, y in points])
+    >>> print st_nan.lookup(x=3., y=0.)
+    nan
+
+    Nearest point lookups:
+
+    >>> st_n = ScatteredTable(method='nearest')
+    >>> st_n.addAxis('x', [x for x, y in points])
+    >>> st_n.addAxis('y', [y for x, y in points])
+    >>> st_n.setValueTable([example_2var_func(x, y) for x, y in points])
+    >>> print st_n.lookup_many(x=[0.2, 1.9], y=[0.1, 1.7])
+    [ 1. 11.]
+
+    Inverse distance weighted lookups keep the values at the points, but
+    between them are not exact for a plane:
+
+    >>> st_i = ScatteredTable(method='idw', neighbours=3)
+    >>> st_i.addAxis('x', [x for x, y in points])
+    >>> st_i.addAxis('y', [y for x, y in points])
+    >>> st_i.setValueTable([example_2var_func(x, y) for x, y in points])
+    >>> print st_i.lookup_many(x=[1., 0.5], y=[1., 0.])
+    [6.         2.18181818]
+
+    Multiple outputs:
+
+    >>> st_m = ScatteredTable()
+    >>> st_m.addAxis('x', [x for x, y in points])
+    >>> st_m.addAxis('y', [y for x, y in points])
+    >>> st_m.addOutput('f', [example_2var_func(x, y) for x, y in points])
+    >>> st_m.addOutput('g', [x - y for x, y in points])
+    >>> f, g = st_m.lookup(x=1.5, y=1.25)
+    >>> print f, g, st_m.getOutputName(1)
+    7.75 0.25 g
+
+    One axis:
+
+    >>> st_1 = ScatteredTable()
+    >>> st_1.addAxis('x', [3., 1., 2.])
+    >>> st_1.setValueTable([30., 10., 40.])
+    >>> print st_1.lookup_many(x=[0., 1.5, 2.5, 4.])
+    [10. 25. 35. 30.]
+
+    Errors:
+
+    >>> st.lookup(x=1.)
+    Traceback (most recent call last):
+    Error: No axis value for 'y'
+    >>> ScatteredTable(method='cubic')
+    Traceback (most recent call last):
+    Error: Unknown method: 'cubic'
+    >>> st_r = ScatteredTable(outside='raise')
+    >>> st_r.addAxis('x', [0., 1., 0.])
+    >>> st_r.addAxis('y', [0., 0., 1.])
+    >>> st_r.setValueTable([1., 2., 3.])
+    >>> st_r.lookup(x=1., y=1.)
+    Traceback (most recent call last):
+    Error: Point 0 is outside the points of the table
+    >>> st_r.setValueTable([1., 2.])
+    Traceback (most recent call last):
+    Error: Value table size 2 does not match the 3 points
+
+    """
+
+    def __init__(self, method='linear', outside='nearest', rescale=True,
+                 neighbours=None):
+        """Create an empty table.
+
+        method -- 'linear' to interpolate linearly within the Delaunay
+                  simplex around the point
+                  'idw' to weight the values of the nearest points by the
+                  inverse square of their distance
+                  'nearest' to take the value of the nearest point
+        outside -- for linear lookups outside the convex hull of the points:
+                   'nearest' to take the value of the nearest point,
+                   'nan' to return NaN, or 'raise' to raise an Error
+        rescale -- scale each axis by the range of its coordinates before
+                   building the index, so that axes in different units
+                   count alike
+        neighbours -- number of points weighted by the 'idw' method
+                      (default 2^N for N axes, as for a grid cell)
+
+        """
+        if numpy is None:
+            raise Error("ScatteredTable requires numpy and scipy")
+        if method not in ('linear', 'idw', 'nearest'):
+            raise Error("Unknown method: '%s'" % method)
+        if outside not in ('nearest', 'nan', 'raise'):
+            raise Error("Unknown outside policy: '%s'" % outside)
+        self.method = method
+        self.outside = outside
+        self.rescale = rescale
+        self.neighbours = neighbours
+
+        # axis_names - map name->index
+        self.axis_names = {}
+
+        # axes - coordinates of the points along each axis
+        #    [[x0, x1, ..., xm], [y0, y1, ..., ym], ...]
+        self.axes = []
+
+        # value_table - value at each point [val0, val1, ..., valm]
+        self.value_table = []
+
+        # output_names - map name->index, for tables with named outputs
+        self.output_names = {}
+
+        # output_tables - value tables of the named outputs; value_table is
+        #                 the first of them
+        self.output_tables = []
+
+        # _cache - index and arrays built from the points and values,
+        #          cleared whenever they are set
+        self._cache = {}
+
+    def addAxis(self, name, axis_values=None):
+        """Add an axis, with the coordinate of each point along it."""
+
+        if self.axis_names.has_key(name):
+            raise Error("Axis already exists with name: '%s'" % name)
+        self.axis_names[name] = len(self.axes)
+        self.axes.append(axis_values)
+        self._cache.clear()
+
+    def setAxisValues(self, axis_name, axis_values):
+        """Set the coordinates of the points along the specified axis."""
+        self.axes[self.axis_names[axis_name]] = axis_values
+        self._cache.clear()
+
+    def setValueTable(self, value_table):
+        """Set the value at each point, in the order of the coordinates."""
+        if self.output_tables:
+            raise Error("Table has named outputs; use addOutput")
+        self.value_table = self._storedTable(value_table)
+        self._cache.clear()
+
+    def addOutput(self, name, value_table):
+        """Add a named output (dependent variable) at the same points.
+
+        Once a table has named outputs, lookups return a tuple with a value
+        for each output, in the order they were added.  The simplex search
+        and the interpolation weights are shared by all the outputs.
+
+        """
+        if self.output_names.has_key(name):
+            raise Error("Output already exists with name: '%s'" % name)
+        if len(self.value_table) and not self.output_tables:
+            raise Error("Table already has an unnamed value table")
+        value_table = self._storedTable(value_table)
+        self.output_names[name] = len(self.output_tables)
+        self.output_tables.append(value_table)
+        self.value_table = self.output_tables[0]
+        self._cache.clear()
+
+    def getOutputName(self, output_i):
+        """Return the name of the specified output. (Index starts at 0)"""
+
+        result = None
+        for name, i in self.output_names.items():
+            if i == output_i:
+                result = name
+                break
+        return result
+
+    def getAxisName(self, axis_i):
+        """Return the name of the specified axis. (Index starts at 0)"""
+
+        result = None
+        for name, i in self.axis_names.items():
+            if i == axis_i:
+                result = name
+                break
+        return result
+
+    def _storedTable(self, value_table):
+        """Return value_table as a float64 array, checking its size."""
+        value_table = numpy.array(value_table, dtype=numpy.float64).ravel()
+        n_points = 0
+        if self.axes and self.axes[0] is not None:
+            n_points = len(self.axes[0])
+        if len(value_table) != n_points:
+            raise Error("Value table size %d does not match the %d points"
+                        % (len(value_table), n_points))
+        return value_table
+
+    def validate(self):
+        """Check that the points and values match.
+
+        Return True if valid, False if not: every axis must have a
+        coordinate for each value, and the points must all be different.
+
+        """
+        if not self.axes or not len(self.value_table):
+            return False
+        for axis in self.axes:
+            if axis is None or len(axis) != len(self.value_table):
+                return False
+        points = self._points()[0]
+        unique = numpy.unique(points.view([('', points.dtype)]
+                                          * points.shape[1]))
+        return len(unique) == len(points)
+
+    def _points(self):
+        """Return (points, offset, scale) as numpy arrays.
+
+        points -- (number of points, number of axes) array of the scaled
+                  coordinates
+
+        """
+        try:
+            return self._cache['points']
+        except KeyError:
+            points = numpy.array(self.axes, dtype=numpy.float64).T
+            offset = numpy.zeros(points.shape[1])
+            scale = numpy.ones(points.shape[1])
+            if self.rescale:
+                offset = points.min(axis=0)
+                spread = points.max(axis=0) - offset
+                scale = 1.0 / numpy.where(spread > 0, spread, 1.0)
+            points = numpy.ascontiguousarray((points - offset) * scale)
+            self._cache['points'] = (points, offset, scale)
+            return self._cache['points']
+
+    def _index(self):
+        """Return the search index of the points, built once.
+
+        This is (tree, triangulation): a cKDTree for nearest point lookups,
+        and a Delaunay triangulation for linear ones with two or more axes
+        (None otherwise).  Single axis tables are kept sorted instead.
+
+        """
+        try:
+            return self._cache['index']
+        except KeyError:
+            points = self._points()[0]
+            tree = cKDTree(points)
+            triangulation = None
+            if self.method == 'linear' and points.shape[1] > 1:
+                try:
+                    triangulation = Delaunay(points)
+                except RuntimeError, e:
+                    raise Error("Points do not span the axes: %s" % e)
+            self._cache['index'] = (tree, triangulation)
+            return self._cache['index']
+
+    def lookup(self, **kwargs):
+        """Lookup the interpolated value for given axis values.
+
+        Arguments:
+        Specify the axis values for the lookup, using the axis names as
+        keyword arguments.
+
+        For a table with named outputs a tuple of the output values is
+        returned.  (This is lookup_many for a single point; use lookup_many
+        for many points.)
+
+        """
+        results = self.lookup_many(**kwargs)
+        if self.output_tables:
+            return tuple([float(result) for result in results])
+        return float(results)
+
+    def lookup_many(self, **kwargs):
+        """Lookup the interpolated values for arrays of axis values.
+
+        Arguments:
+        Specify sequences (or numpy arrays) of axis values, using the axis
+        names as keyword arguments.  They are broadcast against each other,
+        and a numpy array of the broadcast shape is returned (a tuple of them
+        for a table with named outputs).
+
+        """
+        # Check that a value table exists.
+        if not len(self.value_table):
+            raise Error("No values set for lookup table")
+
+        # Check that axis values have been specified.
+        for axis_name in self.axis_names.keys():
+            if kwargs.get(axis_name) is None:
+                raise Error("No axis value for '%s'" % axis_name)
+
+        axis_values = [None] * len(self.axes)
+        for axis_name, axis_i in self.axis_names.items():
+            axis_values[axis_i] = numpy.asarray(kwargs[axis_name],
+                                                dtype=numpy.float64)
+        axis_values = numpy.broadcast_arrays(*axis_values)
+        shape = axis_values[0].shape
+        points, offset, scale = self._points()
+        query = (numpy.column_stack([axis_value.ravel()
+                                     for axis_value in axis_values])
+                 - offset) * scale
+
+        value_tables = self.output_tables or [self.value_table]
+        if self.method == 'nearest':
+            nearest_i = self._index()[0].query(query)[1]
+            results = [value_table[nearest_i] for value_table in value_tables]
+        elif self.method == 'idw':
+            results = self._interp_idw(query, value_tables)
+        elif points.shape[1] == 1:
+            results = self._interp_1d(query[:, 0], value_tables)
+        else:
+            results = self._interp_simplex(query, value_tables)
+
+        results = [result.reshape(shape) for result in results]
+        if self.output_tables:
+            return tuple(results)
+        return results[0]
+
+    def _outside(self, outside, query, results, value_tables):
+        """Apply the outside policy to the points outside the hull."""
+        if not outside.any():
+            return
+        if self.outside == 'raise':
+            raise Error("Point %d is outside the points of the table"
+                        % numpy.flatnonzero(outside)[0])
+        if self.outside == 'nan':
+            for result in results:
+                result[outside] = numpy.nan
+            return
+        nearest_i = self._index()[0].query(query[outside])[1]
+        for result, value_table in zip(results, value_tables):
+            result[outside] = value_table[nearest_i]
+
+    def _interp_idw(self, query, value_tables):
+        """Weight the values of the nearest points by inverse distance."""
+        tree = self._index()[0]
+        neighbours = self.neighbours or 2 ** query.shape[1]
+        neighbours = min(neighbours, tree.n)
+        distances, nearest_i = tree.query(query, neighbours)
+        if neighbours == 1:
+            return [value_table[nearest_i] for value_table in value_tables]
+        # Points of the table keep their own values.
+        exact = distances[:, 0] == 0
+        distances[exact] = 1.0
+        weights = 1.0 / (distances * distances)
+        weights /= weights.sum(axis=1)[:, numpy.newaxis]
+        results = []
+        for value_table in value_tables:
+            result = (value_table[nearest_i] * weights).sum(axis=1)
+            result[exact] = value_table[nearest_i[exact, 0]]
+            results.append(result)
+        return results
+
+    def _interp_1d(self, query, value_tables):
+        """Linearly interpolate between the points of a single axis table."""
+        try:
+            order = self._cache['order']
+        except KeyError:
+            order = numpy.argsort(self._points()[0][:, 0])
+            self._cache['order'] = order
+        coords = self._points()[0][order, 0]
+        results = [numpy.interp(query, coords, value_table[order])
+                   for value_table in value_tables]
+        with numpy.errstate(invalid='ignore'):
+            outside = (query < coords[0]) | (query > coords[-1])
+        # numpy.interp already holds the end (nearest) values.
+        if self.outside != 'nearest':
+            self._outside(outside, query, results, value_tables)
+        return results
+
+    def _interp_simplex(self, query, value_tables):
+        """Linearly interpolate within the Delaunay simplex of each point.
+
+        The weights of the simplex vertices are the barycentric
+        coordinates of the point, from the affine transforms kept by the
+        triangulation.
+
+        """
+        triangulation = self._index()[1]
+        n_axes = query.shape[1]
+        simplex_i = triangulation.find_simplex(query)
+        outside = simplex_i < 0
+        transform = triangulation.transform[simplex_i]
+        weights = numpy.einsum('ijk,ik->ij', transform[:, :n_axes],
+                               query - transform[:, n_axes])
+        weights = numpy.column_stack([weights, 1.0 - weights.sum(axis=1)])
+        vertices = triangulation.simplices[simplex_i]
+        results = [(value_table[vertices] * weights).sum(axis=1)
+                   for value_table in value_tables]
+        self._outside(outside, query, results, value_tables)
+        return results
+
+
+if __name__ == '__main__':
+    import sys
+    import doctest
+    doctest.testmod(sys.modules['__main__'])
@@ -73,5 +73,7 @@ setup(name='pyDAG',
                'pyDAG/Apps/watermark/watermark.py',
                'pyDAG/System/pyReplace.py'],
       packages=['pyDAG', 'pyDAG.TextProcessing', 'pyDAG.Dynamics', 'pyDAG.Tables', 'pyDAG.System', 'pyDAG.Tkinter'],
-      install_requires=['Pillow']
+      install_requires=['Pillow'],
+      extras_require={'arrays': ['numpy'],
+                      'scattered': ['numpy', 'scipy']}
       )